@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Run report.py for several athletes at once
+
+Takes a JSON file listing athlete profiles, e.g.
+
+    [
+        {
+            "name": "alice",
+            "cache_dir": "~/.cache/strava/alice",
+            "output": "reports/alice.txt",
+            "args": ["Run", "Ride"]
+        },
+        {
+            "name": "bob",
+            "cache_dir": "~/.cache/strava/bob",
+            "output": "reports/bob.txt",
+            "client_id": "...",
+            "client_secret": "..."
+        }
+    ]
+
+Each athlete has their own caches, Strava token (strava_token in their
+cache_dir, authorised by running report.py --cache-dir once) and output
+file, and report.py's arguments besides. Reports run in parallel, each in a
+process of its own, and athletes using the same Strava application, by
+default the one in the environment, share its rate limits."""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import Manager
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import report
+from strava import RateLimiter
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "profiles",
+        type=Path,
+        help="JSON file listing the athletes' profiles",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="number of reports to run at once",
+    )
+    return parser.parse_args(argv)
+
+
+def load_profiles(path):
+    profiles = json.loads(path.read_text())
+    for profile in profiles:
+        profile["cache_dir"] = Path(profile["cache_dir"]).expanduser()
+        profile["output"] = Path(profile["output"]).expanduser()
+        profile.setdefault("args", [])
+        profile.setdefault("client_id", os.environ.get("STRAVA_CLIENT_ID"))
+        profile.setdefault("client_secret", os.environ.get("STRAVA_CLIENT_SECRET"))
+
+        if "--offline" in profile["args"]:
+            continue
+        for key in ["client_id", "client_secret"]:
+            if not profile[key]:
+                print(
+                    f"{profile['name']}: no {key} in the profile, and"
+                    f" STRAVA_{key.upper()} isn't set",
+                    file=sys.stderr,
+                )
+                sys.exit(1)
+    return profiles
+
+
+def run_profile(profile, shared):
+    """Write one athlete's report to their output file"""
+
+    # a worker process runs one report at a time, so this only affects it;
+    # offline, the client isn't needed and may not be set
+    for key in ["client_id", "client_secret"]:
+        if profile[key]:
+            os.environ[f"STRAVA_{key.upper()}"] = profile[key]
+
+    profile["output"].parent.mkdir(parents=True, exist_ok=True)
+    with open(profile["output"], "w") as output, redirect_stdout(output):
+        report.main(
+            [*profile["args"], "--cache-dir", str(profile["cache_dir"])],
+            rate_limiter=RateLimiter(shared=shared),
+        )
+
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    profiles = load_profiles(args.profiles)
+
+    failed = []
+    with Manager() as manager, ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        # Strava's rate limits are per application, not per athlete
+        shared = {}
+        futures = {}
+        for profile in profiles:
+            token_file = profile["cache_dir"] / "strava_token"
+            if "--offline" not in profile["args"] and not token_file.exists():
+                # authorising opens a browser, so isn't done in a batch
+                print(
+                    f"{profile['name']}: no Strava token in {profile['cache_dir']};"
+                    f" run report.py --cache-dir {profile['cache_dir']} first",
+                    file=sys.stderr,
+                )
+                failed.append(profile["name"])
+                continue
+
+            if profile["client_id"] not in shared:
+                shared[profile["client_id"]] = RateLimiter.shared_state(manager)
+            futures[profile["name"]] = executor.submit(
+                run_profile, profile, shared[profile["client_id"]]
+            )
+
+        for name, future in futures.items():
+            try:
+                future.result()
+            except (Exception, SystemExit) as e:
+                print(f"{name}: failed ({e!r})", file=sys.stderr)
+                failed.append(name)
+            else:
+                print(f"{name}: done", file=sys.stderr)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
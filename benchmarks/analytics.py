@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""Compare SplitAnalytics with the per-activity computation it replaced
+
+Generates a synthetic history, checks that both produce exactly the same
+figures for every activity and the same bests, and times each.
+
+    python -m benchmarks.analytics [activities ...]"""
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from math import sqrt
+
+from analytics import SplitAnalytics
+from records import Activity
+
+
+def synthetic_activities(n, activity_type="Run", seed=0):
+    rng = random.Random(seed)
+    start = datetime(2010, 6, 1, tzinfo=timezone.utc)
+    activities = []
+    for i in range(n):
+        pace = rng.uniform(240, 420)
+        splits = []
+        for _ in range(rng.randint(0, 21)):
+            distance = rng.choice([1000.0] * 8 + [rng.uniform(0, 1100)])
+            elapsed_time = max(1, round(distance / 1000 * pace * rng.gauss(1, 0.08)))
+            moving_time = max(1, elapsed_time - rng.randint(0, 10))
+            splits.append(
+                {
+                    "distance": distance,
+                    "elapsed_time": elapsed_time,
+                    "moving_time": moving_time,
+                    "average_speed": round(distance / moving_time, 2) or 0.01,
+                }
+            )
+        distance = sum(split["distance"] for split in splits) or rng.uniform(0, 5000)
+        elapsed_time = max(1, round(distance / 1000 * pace))
+        activities.append(
+            {
+                "id": i,
+                "type": activity_type,
+                "name": f"Activity {i}",
+                "start_date": start + timedelta(hours=i * 13),
+                "distance": distance,
+                "elapsed_time": elapsed_time,
+                "moving_time": elapsed_time,
+                "average_speed": distance / elapsed_time,
+                "splits_metric": splits,
+            }
+        )
+    return activities
+
+
+def reference(activities, activity_type):
+    """report.py's original per-activity computation"""
+
+    results = []
+    best = {"overall": None, "km": None, "consistency": None}
+    for activity in activities:
+        average_speed = activity["distance"] / activity["elapsed_time"]
+        if activity["distance"] > 900:
+            if not best["overall"] or best["overall"][0] < average_speed:
+                best["overall"] = (average_speed, activity["id"])
+
+        if "splits_metric" in activity and len(activity["splits_metric"]) > 1:
+            shown = [
+                split["average_speed"]
+                for split in activity["splits_metric"]
+                if split["distance"] >= 900
+            ]
+            splits = [
+                split
+                for split in activity["splits_metric"]
+                if split["distance"] >= 900
+                and (
+                    (
+                        activity_type == "Ride"
+                        and (split["distance"] / split["elapsed_time"]) <= 20
+                    )
+                    or (split["distance"] / split["elapsed_time"]) <= 4
+                )
+            ]
+            for split in splits:
+                split_average_speed = split["distance"] / (
+                    split["moving_time"]
+                    if activity_type == "Ride"
+                    else split["elapsed_time"]
+                )
+                if not best["km"] or best["km"][0] < split_average_speed:
+                    best["km"] = (split_average_speed, activity["id"])
+
+            if len(splits) < 3:
+                results.append((shown, None))
+                continue
+            normalised_times = [1000 / (split["average_speed"]) for split in splits]
+            mean_split_time = sum(normalised_times) / len(normalised_times)
+            variance = sum([pow(x - mean_split_time, 2) for x in normalised_times]) / (
+                len(normalised_times) - 1
+            )
+            plus_minus = (
+                (max(normalised_times) - mean_split_time)
+                + (mean_split_time - min(normalised_times))
+            ) / 2
+            results.append(
+                (
+                    shown,
+                    (
+                        min(normalised_times),
+                        max(normalised_times),
+                        mean_split_time,
+                        plus_minus,
+                        sqrt(variance),
+                    ),
+                )
+            )
+            if not best["consistency"] or best["consistency"][0] > variance:
+                best["consistency"] = (variance, activity["id"], normalised_times)
+
+    return results, best
+
+
+def vectorised(activities, activity_type):
+    analytics = SplitAnalytics(activities, activity_type)
+    return analytics, (
+        analytics.best_overall(),
+        analytics.best_km(),
+        analytics.most_consistent(),
+    )
+
+
+def unpack(activities, analytics, bests):
+    """Put SplitAnalytics' results in the same shape as reference()'s"""
+
+    results = []
+    for i in range(len(activities)):
+        if not analytics.has_splits[i]:
+            continue
+        results.append(
+            (
+                list(analytics.shown_speeds(i)),
+                (
+                    (
+                        analytics.fastest[i],
+                        analytics.slowest[i],
+                        analytics.mean[i],
+                        analytics.plus_minus[i],
+                        analytics.stddev[i],
+                    )
+                    if analytics.consistent[i]
+                    else None
+                ),
+            )
+        )
+
+    overall, (km, km_speed), consistent = bests
+    best = {
+        "overall": (analytics.average_speed[overall], activities[overall]["id"]),
+        "km": (km_speed, activities[km]["id"]),
+        "consistency": (
+            analytics.variance[consistent],
+            activities[consistent]["id"],
+            list(analytics.splits(consistent)),
+        ),
+    }
+    return results, best
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    for n in sizes:
+        for activity_type in ["Run", "Ride"]:
+            activities = synthetic_activities(n, activity_type)
+            # as stored by ActivityStore, which is what report.py now reads
+            records = [Activity.from_json(activity) for activity in activities]
+            expected, reference_time = timed(reference, activities, activity_type)
+            actual, vectorised_time = timed(vectorised, records, activity_type)
+            assert (
+                unpack(activities, *actual) == expected
+            ), f"results differ for {n} {activity_type}s"
+            print(
+                f"{n:>7} {activity_type:<4}  reference {reference_time:7.3f}s  "
+                f"vectorised {vectorised_time:7.3f}s  "
+                f"({reference_time / vectorised_time:.1f}x)"
+            )
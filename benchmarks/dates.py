@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Compare _fix_single_date with the strptime version it replaced
+
+Generates synthetic activity summaries across whole-hour, negative and
+fractional UTC offsets, checks the results against the original's, and times
+each.
+
+The original formatted the offset as hours * 100, so a fractional offset
+came out wrong (+05:30 as +05:50) or unparseable (+05:45 as +0575). For
+those, the check is instead that the local time is the same and that the
+instant matches Strava's own UTC start_date.
+
+    python -m benchmarks.dates [items ...]"""
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from strava import _fix_single_date
+
+OFFSETS = [
+    0,
+    3600,
+    7200,
+    -14400,
+    -18000,
+    -25200,
+    19800,  # India, +05:30
+    20700,  # Nepal, +05:45
+    -12600,  # Newfoundland, -03:30
+    -9000,  # Newfoundland summer time, -02:30
+    45900,  # Chatham Islands, +12:45
+    -34200,  # Marquesas, -09:30
+]
+
+
+def original(item):
+    if "start_date" in item and "start_date_local" in item:
+        if "utc_offset" in item:
+            if item["utc_offset"] >= 0:
+                item["start_date_local"] = item["start_date_local"].replace(
+                    "Z", f"+{item['utc_offset'] / 3600 * 100:04.0f}"
+                )
+            else:
+                item["start_date_local"] = item["start_date_local"].replace(
+                    "Z", f"{item['utc_offset'] / 3600 * 100:05.0f}"
+                )
+        item["start_date"] = datetime.strptime(
+            item["start_date_local"], "%Y-%m-%dT%H:%M:%S%z"
+        )
+        del item["start_date_local"]
+    return item
+
+
+def synthetic_summaries(n, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2010, 6, 1, tzinfo=timezone.utc)
+    summaries = []
+    for i in range(n):
+        start_date = start + timedelta(seconds=rng.randrange(500_000_000))
+        summary = {
+            "id": i,
+            "start_date": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        if i % 50:
+            # as Strava sends it, a float, and the local time marked as UTC
+            utc_offset = float(rng.choice(OFFSETS))
+            summary["utc_offset"] = utc_offset
+            local = start_date + timedelta(seconds=utc_offset)
+        else:
+            local = start_date
+        summary["start_date_local"] = local.strftime("%Y-%m-%dT%H:%M:%SZ")
+        summaries.append(summary)
+    return summaries
+
+
+def check(summaries):
+    for summary in summaries:
+        expected_instant = datetime.fromisoformat(
+            summary["start_date"].replace("Z", "+00:00")
+        )
+        actual = _fix_single_date(dict(summary))
+        assert "start_date_local" not in actual
+        assert actual["start_date"] == expected_instant, summary
+
+        try:
+            expected = original(dict(summary))
+        except ValueError:
+            # the original couldn't parse e.g. +0575 at all
+            assert summary["utc_offset"] % 3600
+            continue
+
+        if summary.get("utc_offset", 0) % 3600:
+            assert actual["start_date"].replace(tzinfo=None) == expected[
+                "start_date"
+            ].replace(tzinfo=None), summary
+        else:
+            assert actual == expected, summary
+            assert (
+                actual["start_date"].utcoffset() == expected["start_date"].utcoffset()
+            ), summary
+
+
+def timed(func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    for n in sizes:
+        summaries = synthetic_summaries(n)
+        check(summaries)
+
+        # only offsets the original can parse, so that both do the same work
+        parseable = [
+            summary
+            for summary in summaries
+            if summary.get("utc_offset", 0) % 3600 == 0
+            or summary["utc_offset"] % 3600 == 1800
+        ]
+        original_time = timed(original, [dict(s) for s in parseable])
+        fixed_time = timed(_fix_single_date, [dict(s) for s in parseable])
+        print(
+            f"{n:>7}  strptime {original_time:7.3f}s  "
+            f"fromisoformat {fixed_time:7.3f}s  "
+            f"({original_time / fixed_time:.1f}x)"
+        )
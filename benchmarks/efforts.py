@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Compare fastest_segments with a plain two-pointer search
+
+Generates synthetic time and distance streams, with pauses and the odd GPS
+correction setting the distance back, checks that the vectorised search
+finds the same fastest times over a range of distances as a loop moving a
+start and an end pointer along each stream, and times each. Also checks the
+compact encoding the streams are stored in round-trips.
+
+    python -m benchmarks.efforts [activities ...]"""
+
+import random
+import sys
+import time
+from math import inf, isnan
+
+import numpy as np
+
+from streams import _decode, _encode, fastest_segments
+
+LENGTHS = [400, 805, 1000, 1609, 3000, 3219, 5000, 10000, 15000, 16093, 21097]
+
+
+def two_pointer(times, distances, length):
+    """The original approach, one start at a time"""
+
+    best = inf
+    peak = -inf
+    distances = [peak := max(peak, d) for d in distances]
+    end = 0
+    for start in range(len(distances)):
+        target = distances[start] + length
+        while end < len(distances) and distances[end] < target:
+            end += 1
+        if end == len(distances):
+            break
+        if end == 0:
+            continue
+        covered = distances[end] - distances[end - 1]
+        fraction = (target - distances[end - 1]) / covered if covered > 0 else 1.0
+        elapsed = (
+            times[end - 1] + fraction * (times[end] - times[end - 1]) - times[start]
+        )
+        best = min(best, elapsed)
+    return best if best < inf else float("nan")
+
+
+def synthetic_streams(n, seed=0):
+    rng = random.Random(seed)
+    streams = []
+    for _ in range(n):
+        samples = rng.randint(2, 8000)
+        times, distances = [0], [0.0]
+        pace = rng.uniform(2.0, 4.5)
+        for _ in range(samples - 1):
+            step = rng.choice([1, 1, 1, 2, 3]) if rng.random() > 0.002 else 600
+            times.append(times[-1] + step)
+            moved = 0.0 if step == 600 else step * pace * rng.gauss(1, 0.1)
+            if rng.random() < 0.001:
+                moved = -rng.uniform(0, 5)
+            distances.append(round(max(0.0, distances[-1] + moved), 1))
+        streams.append((times, distances))
+    return streams
+
+
+def check(streams):
+    for times, distances in streams:
+        decoded = _decode(_encode(times, distances), len(times))
+        assert np.array_equal(decoded[0], times)
+        assert np.allclose(decoded[1], distances, atol=1e-9)
+
+        elapsed, _ = fastest_segments(times, distances, LENGTHS)
+        for length, actual in zip(LENGTHS, elapsed.tolist()):
+            expected = two_pointer(times, distances, length)
+            assert (isnan(actual) and isnan(expected)) or abs(
+                actual - expected
+            ) < 1e-6, (length, actual, expected)
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000]
+    for n in sizes:
+        streams = synthetic_streams(n)
+        check(streams[:50])
+
+        start = time.perf_counter()
+        for times, distances in streams:
+            for length in LENGTHS:
+                two_pointer(times, distances, length)
+        loop_time = time.perf_counter() - start
+
+        arrays = [(np.array(t, dtype=float), np.array(d)) for t, d in streams]
+        start = time.perf_counter()
+        for times, distances in arrays:
+            fastest_segments(times, distances, LENGTHS)
+        vectorised_time = time.perf_counter() - start
+
+        points = sum(len(t) for t, _ in streams)
+        print(
+            f"{n:>6} activities {points:>9} points  two-pointer {loop_time:7.3f}s  "
+            f"vectorised {vectorised_time:7.3f}s  ({loop_time / vectorised_time:.1f}x)"
+        )
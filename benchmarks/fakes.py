@@ -0,0 +1,429 @@
+"""Stand-ins for Strava and the other services the scripts talk to
+
+FakeStrava serves a synthetic history over HTTP with the same endpoints,
+paging and JSON shape as the real API, plus static map images, and counts
+the requests it answers. The activities are generated from their index, so
+even a very large history takes no memory until it's requested."""
+
+import json
+import random
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import cos, hypot, pi, sin
+from urllib.parse import parse_qs, urlsplit
+
+FIRST_START = datetime(2010, 6, 1, 7, tzinfo=timezone.utc)
+LAST_START = datetime(2025, 6, 1, 7, tzinfo=timezone.utc)
+
+# utc_offset and Strava's timezone label for each
+TIMEZONES = [
+    (0.0, "(GMT+00:00) Europe/London"),
+    (3600.0, "(GMT+01:00) Europe/London"),
+    (7200.0, "(GMT+02:00) Europe/Berlin"),
+    (-18000.0, "(GMT-05:00) America/New_York"),
+    (19800.0, "(GMT+05:30) Asia/Kolkata"),
+]
+
+BEST_EFFORTS = [
+    ("400m", 400),
+    ("1/2 mile", 805),
+    ("1k", 1000),
+    ("1 mile", 1609),
+    ("2 mile", 3219),
+    ("5k", 5000),
+    ("10k", 10000),
+    ("15k", 15000),
+    ("10 mile", 16093),
+    ("20k", 20000),
+    ("Half-Marathon", 21097),
+]
+
+# the smallest valid JPEG, near enough: only the Content-Type is checked
+MAP_IMAGE = bytes.fromhex("ffd8ffe000104a46494600010100000100010000ffd9")
+
+
+def encode_polyline(points):
+    """Google's encoded polyline format, as used for Strava's maps"""
+
+    result = []
+    previous = (0, 0)
+    for point in points:
+        point = tuple(round(i * 1e5) for i in point)
+        for value, last in zip(point, previous):
+            value = value - last
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        previous = point
+    return "".join(result)
+
+
+class SyntheticHistory:
+    """A deterministic history of n activities, oldest first
+
+    Runs mostly, with some rides. Activities follow one of a few dozen
+    routes, with a little GPS noise, or now and then a route of their own,
+    and have metric splits over the route's length and, for runs, best
+    efforts as Strava would compute them."""
+
+    def __init__(self, n, seed=0):
+        self.n = n
+        self.seed = seed
+        self._interval = (LAST_START - FIRST_START).total_seconds() / max(n, 1)
+
+        rng = random.Random(seed)
+        self.routes = []
+        for _ in range(max(1, min(40, n // 20))):
+            lat, lng = 51.5 + rng.uniform(-0.3, 0.3), -0.1 + rng.uniform(-0.5, 0.5)
+            radius = rng.uniform(0.005, 0.03)
+            self.routes.append(
+                [
+                    (
+                        lat + radius * sin(2 * pi * step / 50),
+                        lng + radius * 1.6 * cos(2 * pi * step / 50),
+                    )
+                    for step in range(51)
+                ]
+            )
+        self.route_lengths = [
+            sum(
+                hypot(
+                    (b[0] - a[0]) * 111_320,
+                    (b[1] - a[1]) * 111_320 * cos(b[0] * pi / 180),
+                )
+                for a, b in zip(route, route[1:])
+            )
+            for route in self.routes
+        ]
+
+    def start_timestamp(self, i):
+        jitter = (i * 7919) % max(1, int(self._interval / 2))
+        return FIRST_START.timestamp() + int(i * self._interval) + jitter
+
+    def index_after(self, timestamp):
+        """Index of the first activity starting after timestamp"""
+
+        low, high = 0, self.n
+        while low < high:
+            middle = (low + high) // 2
+            if self.start_timestamp(middle) <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def id(self, i):
+        return 1_000_000 + i
+
+    def index(self, activity_id):
+        i = activity_id - 1_000_000
+        return i if 0 <= i < self.n else None
+
+    @lru_cache(maxsize=4096)
+    def detail(self, i):
+        rng = random.Random(self.seed * 1_000_003 + i)
+        activity_type = "Ride" if i % 4 == 3 else "Run"
+        ride = activity_type == "Ride"
+
+        utc_offset, timezone_name = TIMEZONES[i % 7 % len(TIMEZONES)]
+        start = datetime.fromtimestamp(self.start_timestamp(i), timezone.utc)
+        pace = rng.uniform(120, 180) if ride else rng.uniform(240, 420)
+
+        route = i % len(self.routes)
+        # as recorded, give or take a little GPS error
+        length = self.route_lengths[route] * rng.gauss(1, 0.01)
+        distances = [1000.0] * int(length // 1000)
+        if length % 1000 >= 5:
+            distances.append(round(length % 1000, 1))
+
+        splits = []
+        for split, distance in enumerate(distances):
+            elapsed_time = max(1, round(distance / 1000 * pace * rng.gauss(1, 0.06)))
+            moving_time = max(1, elapsed_time - rng.randint(0, 8))
+            splits.append(
+                {
+                    "distance": distance,
+                    "elapsed_time": elapsed_time,
+                    "elevation_difference": round(rng.uniform(-15, 15), 1),
+                    "moving_time": moving_time,
+                    "split": split + 1,
+                    "average_speed": round(distance / moving_time, 2),
+                    "pace_zone": rng.randint(1, 5),
+                }
+            )
+
+        distance = round(sum(split["distance"] for split in splits), 1)
+        elapsed_time = sum(split["elapsed_time"] for split in splits)
+        moving_time = sum(split["moving_time"] for split in splits)
+
+        best_efforts = []
+        if not ride:
+            for name, effort_distance in BEST_EFFORTS:
+                if effort_distance > distance:
+                    break
+                best_efforts.append(
+                    {
+                        "name": name,
+                        "elapsed_time": round(
+                            effort_distance / 1000 * pace * rng.uniform(0.9, 1.0)
+                        ),
+                        "distance": effort_distance,
+                        "start_index": 0,
+                        "end_index": 0,
+                    }
+                )
+
+        # somewhere else entirely, every so often
+        shift = rng.uniform(0.05, 0.2) if i % 10 == 9 else 0.0
+        points = [
+            (lat + shift + rng.gauss(0, 0.00005), lng + rng.gauss(0, 0.00005))
+            for lat, lng in self.routes[route]
+        ]
+        polyline = encode_polyline(points)
+
+        return {
+            "id": self.id(i),
+            "resource_state": 3,
+            "athlete": {"id": 1, "resource_state": 1},
+            "name": f"{'Morning' if i % 2 else 'Evening'} {activity_type}",
+            "description": "" if i % 5 else f"Synthetic activity {i}",
+            "type": activity_type,
+            "sport_type": activity_type,
+            "distance": distance,
+            "moving_time": moving_time,
+            "elapsed_time": elapsed_time,
+            "total_elevation_gain": round(rng.uniform(0, 200), 1),
+            "start_date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "start_date_local": (start + timedelta(seconds=utc_offset)).strftime(
+                "%Y-%m-%dT%H:%M:%SZ"
+            ),
+            "timezone": timezone_name,
+            "utc_offset": utc_offset,
+            "start_latlng": list(points[0]),
+            "end_latlng": list(points[-1]),
+            "average_speed": round(distance / moving_time, 3),
+            "max_speed": round(distance / moving_time * 1.4, 3),
+            "map": {
+                "id": f"a{self.id(i)}",
+                "polyline": polyline,
+                "summary_polyline": polyline,
+                "resource_state": 3,
+            },
+            "splits_metric": splits,
+            "best_efforts": best_efforts,
+            "laps": [
+                {
+                    "id": self.id(i) * 100,
+                    "name": "Lap 1",
+                    "elapsed_time": elapsed_time,
+                    "moving_time": moving_time,
+                    "distance": distance,
+                }
+            ],
+        }
+
+    def streams(self, i):
+        """Time and distance streams, sampled every few seconds
+
+        Each split is covered at its own steady pace, so that the fastest
+        stretches of the streams agree with the splits."""
+
+        time, distance = [0], [0.0]
+        split_time, split_distance = 0, 0.0
+        for split in self.detail(i)["splits_metric"]:
+            elapsed = 0
+            while elapsed < split["elapsed_time"]:
+                elapsed = min(split["elapsed_time"], elapsed + 3)
+                time.append(split_time + elapsed)
+                distance.append(
+                    round(
+                        split_distance
+                        + split["distance"] * elapsed / split["elapsed_time"],
+                        1,
+                    )
+                )
+            split_time += split["elapsed_time"]
+            split_distance += split["distance"]
+
+        return {
+            key: {
+                "data": data,
+                "series_type": "distance",
+                "original_size": len(data),
+                "resolution": "high",
+            }
+            for key, data in [("time", time), ("distance", distance)]
+        }
+
+    def summary(self, i):
+        detail = self.detail(i)
+        summary = {
+            key: value
+            for key, value in detail.items()
+            if key not in ("description", "splits_metric", "best_efforts", "laps")
+        }
+        summary["map"] = {
+            "id": detail["map"]["id"],
+            "summary_polyline": detail["map"]["summary_polyline"],
+            "resource_state": 2,
+        }
+        summary["resource_state"] = 2
+        return summary
+
+
+class FakeStrava:
+    """A local HTTP server answering like the Strava API
+
+    Serves /oauth/token, /athlete/activities, /activities/{id} and
+    /activities/{id}/streams under base_url, and static map images at map_url. Rate limit headers report
+    rate_limit, as (15-minute, daily), and the requests answered since usage
+    was last reset as the usage of both; by default the limits are high
+    enough never to cause a pause. Requests are counted per endpoint in calls, and response bytes
+    in bytes_sent."""
+
+    def __init__(self, history, rate_limit=(1000000, 10000000)):
+        self.history = history
+        self.rate_limit = rate_limit
+        self.usage = 0
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately; don't let Nagle's
+            # algorithm hold back the body on a kept-alive connection
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake._handle(self)
+
+            def do_POST(self):
+                fake._handle(self)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        port = self._server.server_address[1]
+        self.base_url = f"http://127.0.0.1:{port}/api/v3"
+        self.map_url = f"http://127.0.0.1:{port}/maps/api/staticmap"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.calls), self.bytes_sent
+
+    def _handle(self, request):
+        url = urlsplit(request.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if request.command == "POST":
+            request.rfile.read(int(request.headers.get("Content-Length", 0)))
+
+        endpoint, status, body, content_type = self._route(url.path, params)
+        with self._lock:
+            self.calls[endpoint] += 1
+            self.bytes_sent += len(body)
+            self.usage += 1
+            usage = self.usage
+
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.send_header("X-RateLimit-Limit", "{},{}".format(*self.rate_limit))
+        request.send_header("X-RateLimit-Usage", f"{usage},{usage}")
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _route(self, path, params):
+        history = self.history
+
+        if path == "/maps/api/staticmap":
+            return "map", 200, MAP_IMAGE, "image/jpeg"
+
+        path = path.removeprefix("/api/v3")
+        if path == "/oauth/token":
+            data = {
+                "token_type": "Bearer",
+                "access_token": "benchmark",
+                "refresh_token": "benchmark",
+                "expires_at": int(datetime.now().timestamp()) + 6 * 3600,
+            }
+            return "token", 200, json.dumps(data).encode(), "application/json"
+
+        if path == "/athlete/activities":
+            per_page = int(params.get("per_page", 30))
+            page = int(params.get("page", 1))
+            first = history.index_after(float(params.get("after", 0)))
+            first += (page - 1) * per_page
+            data = [
+                history.summary(i)
+                for i in range(first, min(first + per_page, history.n))
+            ]
+            return "list", 200, json.dumps(data).encode(), "application/json"
+
+        if path.startswith("/activities/") and path.endswith("/streams"):
+            i = history.index(int(path.split("/")[2]))
+            if i is None:
+                return "streams", 404, b"{}", "application/json"
+            return (
+                "streams",
+                200,
+                json.dumps(history.streams(i)).encode(),
+                "application/json",
+            )
+
+        if path.startswith("/activities/"):
+            i = history.index(int(path.rsplit("/", 1)[1]))
+            if i is None:
+                data = {
+                    "message": "Record Not Found",
+                    "errors": [
+                        {"resource": "Activity", "field": "id", "code": "not found"}
+                    ],
+                }
+                return "detail", 404, json.dumps(data).encode(), "application/json"
+            return (
+                "detail",
+                200,
+                json.dumps(history.detail(i)).encode(),
+                "application/json",
+            )
+
+        return "other", 404, b"{}", "application/json"
+
+
+class StubGeocoder:
+    """Stands in for MapBoxGeocoder, naming places after their coordinates"""
+
+    calls = 0
+    _lock = threading.Lock()
+
+    def __init__(self, api_key=None):
+        pass
+
+    def reverse(self, point):
+        with StubGeocoder._lock:
+            StubGeocoder.calls += 1
+        return f"Place {point[0]:.2f} {point[1]:.2f}"
+
+
+# stands in for the dayone2 CLI: counts entries, one line each, and succeeds
+DAYONE2 = """#!/bin/sh
+echo >> "$DAYONE2_LOG"
+"""
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Check that RateLimiter pauses until the next rate limit window
+
+With the clock and time.sleep replaced, checks that nearing the 15-minute
+limit pauses until the next quarter hour, from every minute of the hour and
+either side of each window's start, and nearing the daily limit until
+midnight UTC. Then fetches activity details from a FakeStrava with small
+limits, so that the client itself hits the pause, each pause starting the
+server's next window, and checks it was taken once for each window's worth
+of requests.
+
+    python -m benchmarks.ratelimit"""
+
+import io
+import json
+import tempfile
+import time
+from contextlib import redirect_stderr
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+
+import strava
+from benchmarks.fakes import FakeStrava, SyntheticHistory
+from strava import RateLimiter, Strava
+
+
+def pause(now, limit, usage):
+    """How long wait() sleeps at now, with limit and usage reported"""
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now.astimezone(tz)
+
+    sleeps = []
+    rate_limiter = RateLimiter()
+    rate_limiter.update(
+        {
+            "X-RateLimit-Limit": ",".join(map(str, limit)),
+            "X-RateLimit-Usage": ",".join(map(str, usage)),
+        }
+    )
+    with mock.patch.object(strava, "datetime", Clock), mock.patch.object(
+        strava.time, "sleep", sleeps.append
+    ), redirect_stderr(io.StringIO()):
+        rate_limiter.wait()
+    return sleeps[0] if sleeps else None
+
+
+def check_windows():
+    start = datetime(2024, 3, 1, 7, 0, tzinfo=timezone.utc)
+    for second in range(0, 3600, 20):
+        for offset in [0, 0.001, 19.999]:
+            now = start + timedelta(seconds=second + offset)
+            slept = pause(now, (100, 1000), (98, 200))
+            resume = now + timedelta(seconds=slept)
+            assert 0 < slept <= 900, (now, slept)
+            assert resume.minute % 15 == 0 and resume.second == 0, (now, resume)
+            assert resume.microsecond == 0, (now, resume)
+
+    now = start + timedelta(hours=16, minutes=59, seconds=30)
+    slept = pause(now, (100, 1000), (10, 998))
+    assert slept == (datetime(2024, 3, 2, tzinfo=timezone.utc) - now).total_seconds()
+
+    assert pause(start, (100, 1000), (50, 500)) is None
+
+
+def check_client(requests=40, limit=10, headroom=2):
+    history = SyntheticHistory(requests)
+    sleeps = []
+    with tempfile.TemporaryDirectory() as tmp, FakeStrava(
+        history, rate_limit=(limit, 100000)
+    ) as fake:
+        token_file = Path(tmp) / "strava_token"
+        token_file.write_text(
+            json.dumps(
+                {
+                    "access_token": "benchmark",
+                    "refresh_token": "benchmark",
+                    "expires_at": int(time.time()) + 6 * 3600,
+                }
+            )
+        )
+        client = Strava(
+            "id",
+            "secret",
+            base_url=fake.base_url,
+            max_workers=1,
+            token_file=token_file,
+            rate_limiter=RateLimiter(headroom=headroom),
+        )
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            fake.usage = 0
+
+        with mock.patch.object(strava.time, "sleep", sleep), redirect_stderr(
+            io.StringIO()
+        ):
+            for i in range(requests):
+                client.get(f"/activities/{history.summary(i)['id']}")
+
+    assert sleeps and all(0 < slept <= 900 for slept in sleeps), sleeps
+    # each window lets limit - headroom requests through
+    expected = (requests - 1) // (limit - headroom)
+    assert len(sleeps) == expected, (len(sleeps), expected)
+    return len(sleeps)
+
+
+if __name__ == "__main__":
+    check_windows()
+    print("15-minute and daily windows: ok")
+    print(f"client against FakeStrava: ok, paused {check_client()} times")
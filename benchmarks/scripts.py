@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""Time report.py and dayone.py end to end against a fake Strava
+
+For each history size, serves that many synthetic activities from a local
+FakeStrava and runs, in a fresh cache directory:
+
+    report cold     report.py Run, syncing the whole history
+    report warm     report.py Run again, with nothing new to sync
+    report offline  report.py Run --offline, from the caches alone
+    dayone cold     dayone.py Run, downloading maps and posting every entry
+    dayone warm     dayone.py Run again, with nothing new to post
+    both types      report.py Run Ride, adding rides in one more listing
+
+Each run is a separate process, so that its start-up and peak memory are
+its own, with Strava, the static map endpoint, MapBox and dayone2 all
+replaced by stand-ins from benchmarks.fakes. Reports wall time, requests per
+endpoint, geocoder lookups, entries posted, peak memory, and the time spent
+loading and saving the caches.
+
+    python -m benchmarks.scripts [activities ...]"""
+
+import functools
+import json
+import os
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from benchmarks.fakes import DAYONE2, FakeStrava, StubGeocoder, SyntheticHistory
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SCENARIOS = [
+    ("report cold", "report.py", ["Run"]),
+    ("report warm", "report.py", ["Run"]),
+    ("report offline", "report.py", ["Run", "--offline"]),
+    ("dayone cold", "dayone.py", ["Run"]),
+    ("dayone warm", "dayone.py", ["Run"]),
+    ("both types", "report.py", ["Run", "Ride"]),
+]
+
+# time spent in these counts as loading or saving the caches
+CACHE_LOADS = [
+    ("store", "ActivityStore", "__init__"),
+    ("store", "ActivityStore", "scan"),
+    ("store", "ActivityStore", "items"),
+    ("leaderboard", "Leaderboard", "__init__"),
+    ("ledger", "DayOneLedger", "__init__"),
+    ("geocode", "LocationCache", "__init__"),
+    ("sync", "Watermark", "__init__"),
+]
+CACHE_SAVES = [
+    ("store", "ActivityStore", "__setitem__"),
+    ("leaderboard", "Leaderboard", "update"),
+    ("ledger", "DayOneLedger", "record"),
+    ("sync", "Watermark", "save"),
+]
+
+
+def _timed(func, totals, bucket):
+    if func.__name__ in ("scan", "items"):
+        # generators: time each step, not just their creation
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            iterator = func(*args, **kwargs)
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    totals[bucket] += time.perf_counter() - start
+                yield item
+
+    else:
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                totals[bucket] += time.perf_counter() - start
+
+    return wrapper
+
+
+def child(script, result_path, args):
+    """Run one script with the stand-ins in place, and record its figures"""
+
+    import geocode
+    import maps
+    import strava
+
+    strava.Strava = functools.partial(
+        strava.Strava, base_url=os.environ["BENCHMARK_STRAVA_URL"]
+    )
+    maps.STATIC_MAP_URL = os.environ["BENCHMARK_MAP_URL"]
+    geocode.MapBoxGeocoder = StubGeocoder
+
+    totals = defaultdict(float)
+    for bucket, patches in [("load", CACHE_LOADS), ("save", CACHE_SAVES)]:
+        for module_name, class_name, method in patches:
+            cls = getattr(__import__(module_name), class_name)
+            setattr(cls, method, _timed(getattr(cls, method), totals, bucket))
+
+    sys.argv = [script, *args]
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        runpy.run_path(str(ROOT / script), run_name="__main__")
+    elapsed = time.perf_counter() - start
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    Path(result_path).write_text(
+        json.dumps(
+            {
+                "elapsed": elapsed,
+                # kilobytes on Linux, bytes on macOS
+                "peak_mb": maxrss / (1024**2 if sys.platform == "darwin" else 1024),
+                "load": totals["load"],
+                "save": totals["save"],
+                "geocodes": StubGeocoder.calls,
+            }
+        )
+    )
+
+
+def run(fake, cache_dir, bin_dir, script, args=()):
+    result_path = cache_dir / "benchmark-result.json"
+    env = {
+        **os.environ,
+        "PATH": f"{bin_dir}{os.pathsep}{os.environ['PATH']}",
+        "PYTHONPATH": str(ROOT),
+        "XDG_CACHE_HOME": str(cache_dir),
+        "STRAVA_CLIENT_ID": "benchmark",
+        "STRAVA_CLIENT_SECRET": "benchmark",
+        "MAPBOX_API_KEY": "benchmark",
+        "GOOGLE_API_KEY": "benchmark",
+        "BENCHMARK_STRAVA_URL": fake.base_url,
+        "BENCHMARK_MAP_URL": fake.map_url,
+        "DAYONE2_LOG": str(cache_dir / "dayone2.log"),
+    }
+
+    calls_before, bytes_before = fake.stats()
+    posted_before = _posted(cache_dir)
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.scripts",
+            "--child",
+            script,
+            str(result_path),
+            *args,
+        ],
+        env=env,
+        cwd=cache_dir,
+        check=True,
+    )
+    wall = time.perf_counter() - start
+    calls_after, bytes_after = fake.stats()
+
+    result = json.loads(result_path.read_text())
+    result["wall"] = wall
+    result["calls"] = {
+        endpoint: count - calls_before.get(endpoint, 0)
+        for endpoint, count in calls_after.items()
+        if count - calls_before.get(endpoint, 0)
+    }
+    result["bytes"] = bytes_after - bytes_before
+    result["posted"] = _posted(cache_dir) - posted_before
+    return result
+
+
+def _posted(cache_dir):
+    log = cache_dir / "dayone2.log"
+    return len(log.read_text().splitlines()) if log.exists() else 0
+
+
+def benchmark(n):
+    with tempfile.TemporaryDirectory() as tmp, FakeStrava(SyntheticHistory(n)) as fake:
+        cache_dir = Path(tmp) / "cache"
+        cache_dir.mkdir()
+        bin_dir = Path(tmp) / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "dayone2").write_text(DAYONE2)
+        (bin_dir / "dayone2").chmod(0o755)
+        (cache_dir / "strava_token").write_text(
+            json.dumps(
+                {
+                    "access_token": "benchmark",
+                    "refresh_token": "benchmark",
+                    "expires_at": time.time() + 6 * 3600,
+                }
+            )
+        )
+
+        for name, script, args in SCENARIOS:
+            yield name, run(fake, cache_dir, bin_dir, script, args)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2], sys.argv[3], sys.argv[4:])
+        sys.exit()
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    print(
+        f"{'activities':>10}  {'scenario':<14} {'wall':>8} {'list':>6} "
+        f"{'detail':>7} {'streams':>7} {'map':>7} {'MB sent':>8} {'geocode':>7} {'posted':>7} "
+        f"{'peak MB':>8} {'load':>7} {'save':>7}"
+    )
+    for n in sizes:
+        for name, result in benchmark(n):
+            calls = result["calls"]
+            print(
+                f"{n:>10}  {name:<14} {result['wall']:7.2f}s "
+                f"{calls.get('list', 0):>6} {calls.get('detail', 0):>7} "
+                f"{calls.get('streams', 0):>7} "
+                f"{calls.get('map', 0):>7} {result['bytes'] / 1024**2:>8.1f} "
+                f"{result['geocodes']:>7} {result['posted']:>7} "
+                f"{result['peak_mb']:>8.1f} {result['load']:6.2f}s "
+                f"{result['save']:6.2f}s",
+                flush=True,
+            )
@@ -0,0 +1,134 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+from geopy.geocoders import MapBox
+
+from instrumentation import stats
+
+
+class MapBoxGeocoder:
+    """Reverse geocoding through MapBox, down to a short place name
+
+    Any object with the same reverse() method can stand in for it, e.g. to
+    avoid network access in tests."""
+
+    def __init__(self, api_key):
+        self._geolocator = MapBox(api_key=api_key)
+
+    def reverse(self, point):
+        with stats.timed_request("MapBox reverse"):
+            location = self._geolocator.reverse(point)
+        if not location:
+            return None
+        return ", ".join(
+            [
+                l["text"]
+                for l in location.raw["context"]
+                if l["id"].startswith("place.")
+                or l["id"].startswith("neighbourhood.")
+                or l["id"].startswith("locality.")
+            ]
+        )
+
+
+class LocationCache:
+    """Place names for coordinates, kept on disk by grid cell
+
+    Coordinates are snapped to cells of a hundredth of a degree (about 1km),
+    and each cell is geocoded once, ever. A cell that hasn't been geocoded
+    reuses a name from any resolved cell within radius cells of it. Without
+    a geocoder, only names already cached are used."""
+
+    def __init__(self, path, geocoder, radius=1, max_workers=8):
+        self._geocoder = geocoder
+        self.radius = radius
+        self.max_workers = max_workers
+
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS locations (
+                    lat INTEGER NOT NULL,
+                    lng INTEGER NOT NULL,
+                    name TEXT,
+                    PRIMARY KEY (lat, lng)
+                )""")
+        self._cells = {
+            (lat, lng): name
+            for lat, lng, name in self._db.execute("SELECT * FROM locations")
+        }
+
+    def _cell(self, latlng):
+        return tuple(round(i * 100) for i in latlng)
+
+    def _neighbours(self, cell):
+        """Cells within radius of cell, nearest first"""
+
+        for distance in range(1, self.radius + 1):
+            for offset in product(range(-distance, distance + 1), repeat=2):
+                if max(abs(i) for i in offset) == distance:
+                    yield (cell[0] + offset[0], cell[1] + offset[1])
+
+    def _nearby(self, cell):
+        """Name of the cell, or failing that of the nearest resolved cell"""
+
+        if cell in self._cells:
+            return cell, self._cells[cell]
+        for neighbour in self._neighbours(cell):
+            if self._cells.get(neighbour):
+                return neighbour, self._cells[neighbour]
+        return None, None
+
+    def _store(self, resolved):
+        self._cells.update(resolved)
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO locations VALUES (?, ?, ?)",
+                [(lat, lng, name) for (lat, lng), name in resolved.items()],
+            )
+
+    def prefetch(self, latlngs):
+        """Geocode every not yet known cell among latlngs concurrently"""
+
+        pending = {}
+        for latlng in latlngs:
+            if not latlng:
+                continue
+            cell = self._cell(latlng)
+            if cell in pending or self._nearby(cell)[0] is not None:
+                continue
+            # likely to be named by a neighbour already being resolved
+            if any(neighbour in pending for neighbour in self._neighbours(cell)):
+                continue
+            pending[cell] = tuple(i / 100 for i in cell)
+
+        if not pending or self._geocoder is None:
+            return
+        stats.miss("locations", len(pending))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            names = executor.map(self._geocoder.reverse, pending.values())
+            self._store(dict(zip(pending, names)))
+
+    def __contains__(self, latlng):
+        """Whether latlng's place is known without geocoding"""
+
+        return bool(latlng) and self._nearby(self._cell(latlng))[0] is not None
+
+    def __getitem__(self, latlng):
+        if not latlng:
+            return None
+
+        cell = self._cell(latlng)
+        found, name = self._nearby(cell)
+        if found is None:
+            stats.miss("locations")
+            if self._geocoder is None:
+                return None
+            name = self._geocoder.reverse(tuple(i / 100 for i in cell))
+            self._store({cell: name})
+        else:
+            stats.hit("locations")
+        return name
+
+    def close(self):
+        self._db.close()
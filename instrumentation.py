@@ -0,0 +1,182 @@
+import cProfile
+import json
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+class Stats:
+    """Where a run's time went, collected only once enabled
+
+    Records wall time per phase of a script, the count, latency and size of
+    requests to each external endpoint (Strava, MapBox, the static maps API,
+    dayone2), cache hits and misses, and the last rate limit usage Strava
+    reported. Disabled, every method returns straight away."""
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._path = None
+        self._reset()
+
+    def _reset(self):
+        self._start = None
+        self._phases = defaultdict(float)
+        self._requests = defaultdict(list)
+        self._bytes = defaultdict(int)
+        self._caches = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self._rate_limit = None
+
+    def enable(self, path=None):
+        """Start collecting afresh; if path is given, finish() writes it there
+
+        path may be "-" for stderr. Anything collected before is dropped,
+        e.g. by a report run earlier in the same process."""
+
+        with self._lock:
+            self._reset()
+        self.enabled = True
+        self._path = path
+        self._start = time.perf_counter()
+
+    def finish(self):
+        """Stop collecting, and write the summary if enable() was given a path
+
+        Called explicitly rather than at exit, as processes in a pool don't
+        run exit handlers."""
+
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self._path is not None:
+            self.write(self._path)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._phases[name] += time.perf_counter() - start
+
+    def request(self, endpoint, seconds, size=0):
+        """Note a request to endpoint, e.g. "GET /activities/{id}" """
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self._requests[endpoint].append(seconds)
+            self._bytes[endpoint] += size
+
+    @contextmanager
+    def timed_request(self, endpoint):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.request(endpoint, time.perf_counter() - start)
+
+    def hit(self, cache, count=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._caches[cache]["hits"] += count
+
+    def miss(self, cache, count=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._caches[cache]["misses"] += count
+
+    def rate_limit(self, limit, usage):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._rate_limit = {
+                "limit": limit,
+                "usage": usage,
+                "headroom": [l - u for l, u in zip(limit, usage)],
+            }
+
+    def summary(self):
+        with self._lock:
+            requests = {}
+            for endpoint, latencies in sorted(self._requests.items()):
+                latencies = sorted(latencies)
+                requests[endpoint] = {
+                    "count": len(latencies),
+                    "seconds": sum(latencies),
+                    "mean": sum(latencies) / len(latencies),
+                    "p50": latencies[len(latencies) // 2],
+                    "p95": latencies[int(len(latencies) * 0.95)],
+                    "max": latencies[-1],
+                    "bytes": self._bytes[endpoint],
+                }
+
+            return {
+                "wall_time": time.perf_counter() - self._start,
+                "phases": dict(self._phases),
+                "requests": requests,
+                "bytes": sum(self._bytes.values()),
+                "caches": {
+                    cache: {
+                        **counts,
+                        "hit_rate": (
+                            counts["hits"] / (counts["hits"] + counts["misses"])
+                            if counts["hits"] + counts["misses"]
+                            else None
+                        ),
+                    }
+                    for cache, counts in sorted(self._caches.items())
+                },
+                "rate_limit": self._rate_limit,
+            }
+
+    def write(self, path):
+        summary = json.dumps(self.summary(), indent=2)
+        if path == "-":
+            print(summary, file=sys.stderr)
+        else:
+            with open(path, "w") as f:
+                f.write(summary + "\n")
+
+
+stats = Stats()
+
+
+def endpoint(method, url):
+    """A request's endpoint with ids elided, to group requests by"""
+
+    path = re.sub(r"/\d+", "/{id}", url.split("?", 1)[0])
+    return f"{method} {path}"
+
+
+def profiled(path):
+    """Profile the body of a with block into path, if path is not None"""
+
+    if path is None:
+        return nullcontext()
+    return _profiled(path)
+
+
+@contextmanager
+def _profiled(path):
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
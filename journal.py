@@ -0,0 +1,137 @@
+import hashlib
+import json
+import subprocess
+import uuid
+import zipfile
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from datetime import timezone
+
+from instrumentation import stats
+
+# where the dayone2 CLI places an entry's attachment in its text
+ATTACHMENT_PLACEHOLDER = "[{attachment}]"
+
+
+def _entry_uuid(entry):
+    # stable per activity, so that an entry can be recognised if imported again
+    return uuid.uuid5(
+        uuid.NAMESPACE_URL,
+        f"https://www.strava.com/activities/{entry['activity_id']}",
+    ).hex.upper()
+
+
+def _command(entry, journal):
+    cmd = [
+        "dayone2",
+        "--journal",
+        journal,
+        "--isoDate",
+        entry["date"].astimezone(timezone.utc).replace(tzinfo=None).isoformat(),
+        "--time-zone",
+        f"GMT{entry['date'].strftime('%z')}",
+        "--tags",
+        *entry["tags"],
+    ]
+    if entry["attachment"]:
+        cmd += ["--attachments", entry["attachment"]]
+    if entry["coordinate"]:
+        cmd += ["--coordinate"] + [str(i) for i in entry["coordinate"]]
+    cmd += ["--", "new", entry["text"]]
+    return cmd
+
+
+def _post(cmd):
+    with stats.timed_request("dayone2"):
+        return subprocess.run(cmd)
+
+
+def post_entries(entries, journal, max_workers=4):
+    """Create entries with the dayone2 CLI, several at a time
+
+    entries may be a generator: only a few more are taken from it than are
+    being posted. Yields each entry along with whether it was created, as
+    they finish."""
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        for entry in entries:
+            running[executor.submit(_post, _command(entry, journal))] = entry
+            if len(running) < max_workers:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield running.pop(future), future.result().returncode == 0
+
+        for future in as_completed(running):
+            yield running[future], future.result().returncode == 0
+
+
+class JournalArchive:
+    """Entries in Day One's JSON export format, for importing all at once
+
+    Written as a zip holding <journal>.json and the attached photos, which
+    Day One can import through File > Import > JSON."""
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.entries = []
+
+    def add(self, entry):
+        self.entries.append(entry)
+
+    def write(self, path):
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            photos = set()
+            records = []
+            for entry in self.entries:
+                record = {
+                    "uuid": _entry_uuid(entry),
+                    "creationDate": entry["date"]
+                    .astimezone(timezone.utc)
+                    .strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "timeZone": entry["time_zone"]
+                    or f"GMT{entry['date'].strftime('%z')}",
+                    "tags": entry["tags"],
+                    "text": entry["text"],
+                }
+
+                if entry["coordinate"]:
+                    record["location"] = {
+                        "latitude": entry["coordinate"][0],
+                        "longitude": entry["coordinate"][1],
+                    }
+
+                if entry["attachment"]:
+                    data = entry["attachment"].read_bytes()
+                    md5 = hashlib.md5(data).hexdigest()
+                    if md5 not in photos:
+                        archive.writestr(f"photos/{md5}.jpeg", data)
+                        photos.add(md5)
+                    identifier = uuid.uuid5(
+                        uuid.NAMESPACE_OID, record["uuid"]
+                    ).hex.upper()
+                    record["photos"] = [
+                        {
+                            "identifier": identifier,
+                            "md5": md5,
+                            "type": "jpeg",
+                            "orderInEntry": 0,
+                        }
+                    ]
+                    record["text"] = record["text"].replace(
+                        ATTACHMENT_PLACEHOLDER, f"![](dayone-moment://{identifier})"
+                    )
+
+                records.append(record)
+
+            archive.writestr(
+                f"{self.journal}.json",
+                json.dumps(
+                    {"metadata": {"version": "1.0"}, "entries": records}, indent=2
+                ),
+            )
@@ -0,0 +1,208 @@
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+
+
+class Leaderboard:
+    """Best efforts of each name, kept ordered fastest first
+
+    Ties go to the more recent effort. Kept in SQLite, indexed by time, so
+    that ranks and the fastest few are found without going through the
+    whole board. Several boards, e.g. one per script and activity type,
+    share a table, each under its own name."""
+
+    def __init__(self, path, board):
+        self.board = board
+
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS leaderboard_efforts (
+                    board TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    elapsed_time INTEGER NOT NULL,
+                    start_timestamp REAL NOT NULL,
+                    start_date TEXT NOT NULL,
+                    PRIMARY KEY (board, id, name)
+                )""")
+            self._db.execute("""CREATE INDEX IF NOT EXISTS leaderboard_efforts_time
+                    ON leaderboard_efforts
+                    (board, name, elapsed_time, start_timestamp DESC)""")
+
+    def __contains__(self, activity_id):
+        return (
+            self._db.execute(
+                "SELECT 1 FROM leaderboard_efforts WHERE board = ? AND id = ? LIMIT 1",
+                (self.board, activity_id),
+            ).fetchone()
+            is not None
+        )
+
+    def _entries(self, activity, efforts):
+        if efforts is None:
+            efforts = activity.best_efforts
+        return [
+            (
+                self.board,
+                activity.id,
+                name,
+                position,
+                elapsed_time,
+                activity.start_date.timestamp(),
+                activity.start_date.isoformat(),
+            )
+            for position, (name, elapsed_time) in enumerate(efforts)
+        ]
+
+    def add(self, activity, efforts=None):
+        """Add or update an activity's best efforts
+
+        efforts are (name, elapsed_time), by default Strava's own."""
+
+        self.update([(activity, efforts)])
+
+    def update(self, activities):
+        """Add or update the best efforts of (activity, efforts) pairs at once
+
+        Activities already on the board with the same efforts are left alone."""
+
+        entries = {
+            activity.id: self._entries(activity, efforts)
+            for activity, efforts in activities
+        }
+        saved = defaultdict(list)
+        activity_ids = list(entries)
+        # within SQLite's limit on the number of parameters
+        for start in range(0, len(activity_ids), 500):
+            chunk = activity_ids[start : start + 500]
+            for row in self._db.execute(
+                f"""SELECT * FROM leaderboard_efforts
+                    WHERE board = ? AND id IN ({", ".join("?" * len(chunk))})
+                    ORDER BY id, position""",
+                (self.board, *chunk),
+            ):
+                saved[row[1]].append(row)
+
+        changed = [
+            activity_id
+            for activity_id, rows in entries.items()
+            if rows != saved[activity_id]
+        ]
+        if not changed:
+            return
+        with self._db:
+            self._delete(changed)
+            self._db.executemany(
+                "INSERT INTO leaderboard_efforts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [entry for activity_id in changed for entry in entries[activity_id]],
+            )
+
+    def iter_update(self, activities, batch_size=100):
+        """update() with (activity, efforts) pairs, a batch at a time
+
+        Yields each pair once it is on the board, without loading them all
+        first."""
+
+        activities = iter(activities)
+        while batch := list(islice(activities, batch_size)):
+            self.update(batch)
+            yield from batch
+
+    def remove(self, activity_ids):
+        with self._db:
+            self._delete(list(activity_ids))
+
+    def _delete(self, activity_ids):
+        # within SQLite's limit on the number of parameters
+        for start in range(0, len(activity_ids), 500):
+            chunk = activity_ids[start : start + 500]
+            self._db.execute(
+                f"""DELETE FROM leaderboard_efforts
+                    WHERE board = ? AND id IN ({", ".join("?" * len(chunk))})""",
+                (self.board, *chunk),
+            )
+
+    def clear(self):
+        with self._db:
+            self._db.execute(
+                "DELETE FROM leaderboard_efforts WHERE board = ?", (self.board,)
+            )
+
+    def rank(self, name, activity_id, limit=None):
+        """Zero-based position of an activity's effort, or None if it has none
+
+        As of the activity: only faster efforts from activities that started
+        no later than it count, so the rank doesn't change as newer efforts
+        are added. Counting stops at limit, if given, so that asking whether
+        an effort is in the top few is quick however far down it is."""
+
+        row = self._db.execute(
+            """SELECT elapsed_time, start_timestamp FROM leaderboard_efforts
+                WHERE board = ? AND id = ? AND name = ?""",
+            (self.board, activity_id, name),
+        ).fetchone()
+        if row is None:
+            return None
+        elapsed_time, start_timestamp = row
+        return self._db.execute(
+            """SELECT COUNT(*) FROM (
+                SELECT 1 FROM leaderboard_efforts
+                WHERE board = ? AND name = ? AND start_timestamp <= ?
+                    AND (elapsed_time < ? OR elapsed_time = ?
+                        AND start_timestamp = ? AND id < ?)
+                LIMIT ?)""",
+            (
+                self.board,
+                name,
+                start_timestamp,
+                elapsed_time,
+                elapsed_time,
+                start_timestamp,
+                activity_id,
+                -1 if limit is None else limit,
+            ),
+        ).fetchone()[0]
+
+    def names(self):
+        """Names of the efforts on the board, in the order activities give them"""
+
+        return [
+            row[0]
+            for row in self._db.execute(
+                """SELECT name FROM leaderboard_efforts WHERE board = ?
+                    GROUP BY name ORDER BY MIN(position), name""",
+                (self.board,),
+            )
+        ]
+
+    def top(self, name, n=5):
+        return [
+            {
+                "elapsed_time": elapsed_time,
+                "activity_id": activity_id,
+                "start_date": datetime.fromisoformat(start_date),
+            }
+            for elapsed_time, activity_id, start_date in self._db.execute(
+                """SELECT elapsed_time, id, start_date FROM leaderboard_efforts
+                    WHERE board = ? AND name = ?
+                    ORDER BY elapsed_time, start_timestamp DESC, id LIMIT ?""",
+                (self.board, name, n),
+            )
+        ]
+
+    def prune(self, activity_ids):
+        """Drop every activity not in activity_ids, e.g. deleted ones"""
+
+        on_board = {
+            row[0]
+            for row in self._db.execute(
+                "SELECT DISTINCT id FROM leaderboard_efforts WHERE board = ?",
+                (self.board,),
+            )
+        }
+        self.remove(on_board - set(activity_ids))
+
+    def close(self):
+        self._db.close()
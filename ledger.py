@@ -0,0 +1,76 @@
+import json
+import os
+import pickle
+from datetime import datetime, timezone
+
+
+class DayOneLedger:
+    """Activities already posted to Day One
+
+    An append-only log of JSON lines, one per journal entry, recording when it
+    was posted and whether its map was attached. Only the in-memory index is
+    consulted for membership, and each entry costs a single appended line."""
+
+    def __init__(self, path):
+        self._path = path
+        self.entries = {}
+
+        contents = ""
+        if self._path.exists():
+            contents = self._path.read_text()
+            for line in contents.splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line torn by a crash mid-write; that entry is retried
+                    continue
+                self.entries[record["id"]] = record
+
+        self._file = self._path.open("a")
+        if contents and not contents.endswith("\n"):
+            self._file.write("\n")
+        self._migrate(self._path.with_name("strava2dayone.cache"))
+
+    def _migrate(self, cache_path):
+        """Import the pickled list of posted ids used previously"""
+
+        if not cache_path.exists():
+            return
+        self._append(
+            *[
+                {"id": activity_id, "posted_at": None, "attachment": None}
+                for activity_id in pickle.loads(cache_path.read_bytes())
+                if activity_id not in self
+            ]
+        )
+        cache_path.rename(cache_path.with_suffix(".cache.migrated"))
+
+    def __contains__(self, activity_id):
+        return activity_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, activity_id, attachment):
+        """Durably note that an activity has been posted
+
+        attachment is "attached", "missing" if the map couldn't be
+        downloaded, or None if the activity has no map."""
+
+        self._append(
+            {
+                "id": activity_id,
+                "posted_at": datetime.now(timezone.utc).isoformat(),
+                "attachment": attachment,
+            }
+        )
+
+    def _append(self, *records):
+        for record in records:
+            self._file.write(json.dumps(record) + "\n")
+            self.entries[record["id"]] = record
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,96 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import stats
+
+STATIC_MAP_URL = "https://maps.googleapis.com/maps/api/staticmap"
+
+
+class MapImages:
+    """Static map images of activities' routes, cached on disk
+
+    Images are named by a hash of the map's parameters (route and styling but
+    not the API key), so an unchanged map is never downloaded twice. Downloads
+    share a connection pool and run in the background once prefetched.
+    Without an API key, only images already downloaded are used."""
+
+    def __init__(self, cache_dir, api_key=None, max_workers=4):
+        self._dir = cache_dir
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._api_key = api_key
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_workers))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._downloads = {}
+
+    def _query(self, activity):
+        if not activity.polyline:
+            return None
+
+        query = f"size=600x300&maptype=da&scale=2&path=color:0xff481eff|weight:2|enc:{activity.polyline}&style=feature:road.highway|element:geometry|color:0xFFFFFF&style=feature:transit.station.airport|element:labels.icon|visibility:off&style=feature:poi|element:labels.icon|visibility:off&style=feature:road.highway|element:geometry.stroke|color:0xDDDDDD"
+        if activity.type != "Ride":
+            query += "&style=feature:road|element:labels.icon|visibility:off"
+        return query
+
+    def _download(self, query, path):
+        if path.exists():
+            stats.hit("maps")
+            return path
+
+        stats.miss("maps")
+        if self._api_key is None:
+            return None
+        start = time.perf_counter()
+        response = self.session.get(f"{STATIC_MAP_URL}?{query}&key={self._api_key}")
+        stats.request(
+            "GET staticmap", time.perf_counter() - start, len(response.content)
+        )
+        content_type = response.headers.get("Content-Type", "")
+        if not response.ok or not content_type.startswith("image/"):
+            return None
+
+        partial = path.with_suffix(".part")
+        partial.write_bytes(response.content)
+        partial.rename(path)
+        return path
+
+    def _submit(self, activity):
+        query = self._query(activity)
+        if query is None:
+            return None
+
+        path = self._dir / f"{hashlib.sha256(query.encode()).hexdigest()}.jpg"
+        if path not in self._downloads:
+            self._downloads[path] = self._executor.submit(self._download, query, path)
+        return self._downloads[path]
+
+    def prefetch(self, activities):
+        """Start downloading the maps of activities in the background"""
+
+        for activity in activities:
+            self._submit(activity)
+
+    def has_map(self, activity):
+        return self._query(activity) is not None
+
+    def get(self, activity):
+        """Path to the activity's map image, or None if it has none
+
+        Also None if the image couldn't be downloaded."""
+
+        download = self._submit(activity)
+        if download is None:
+            return None
+        try:
+            return download.result()
+        except requests.RequestException:
+            return None
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+        self.session.close()
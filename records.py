@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+
+# columns of Activity.splits
+SPLIT_FIELDS = ("distance", "elapsed_time", "moving_time", "average_speed")
+
+
+@dataclass(slots=True, eq=False)
+class Activity:
+    """The parts of a detailed Strava activity that the reports use
+
+    Much smaller than the API's JSON, which also carries segment efforts,
+    laps, photos, gear and so on; that can be kept separately, see
+    ActivityStore.raw(). Splits are a float array with a row per split and
+    the columns in SPLIT_FIELDS."""
+
+    id: int
+    type: str
+    name: str
+    description: str | None
+    start_date: datetime
+    timezone: str | None
+    distance: float
+    moving_time: int
+    elapsed_time: int
+    average_speed: float
+    start_latlng: tuple | None
+    polyline: str | None
+    splits: np.ndarray
+    best_effort_names: tuple
+    best_effort_times: np.ndarray
+
+    @classmethod
+    def from_json(cls, data):
+        """Project an activity as returned by Strava (with dates fixed)"""
+
+        splits = data.get("splits_metric") or []
+        best_efforts = data.get("best_efforts") or []
+        return cls(
+            id=data["id"],
+            type=data["type"],
+            name=data["name"],
+            description=data.get("description"),
+            start_date=data["start_date"],
+            timezone=data.get("timezone"),
+            distance=data["distance"],
+            moving_time=data["moving_time"],
+            elapsed_time=data["elapsed_time"],
+            average_speed=data["average_speed"],
+            start_latlng=(
+                tuple(data["start_latlng"]) if data.get("start_latlng") else None
+            ),
+            polyline=(data.get("map") or {}).get("polyline"),
+            splits=np.array(
+                [[split[field] for field in SPLIT_FIELDS] for split in splits],
+                dtype=float,
+            ).reshape(-1, len(SPLIT_FIELDS)),
+            best_effort_names=tuple(effort["name"] for effort in best_efforts),
+            best_effort_times=np.array(
+                [effort["elapsed_time"] for effort in best_efforts], dtype=int
+            ),
+        )
+
+    @property
+    def best_efforts(self):
+        """(name, elapsed_time) of each of Strava's best efforts"""
+
+        return zip(self.best_effort_names, self.best_effort_times.tolist())
@@ -1,45 +1,22 @@
 #!/usr/bin/env python
 
+import argparse
+import functools
 import os
-import pickle
-import sys
 from datetime import datetime, timedelta
-from math import sqrt
-from pathlib import Path
 
 from dotenv import load_dotenv
-from geopy.geocoders import MapBox
 
-from strava import Strava
+from analytics import SplitAnalytics
+from geocode import LocationCache, MapBoxGeocoder
+from instrumentation import profiled, stats
+from routes import RouteIndex
+from streams import StreamCache, efforts_for
+from summary import SummaryIndex
+from sync import SyncedCaches, add_arguments
 
-load_dotenv()
-
-
-class LocationCache(dict):
-    def __init__(self, *args, **kwargs):
-        self._geolocator = MapBox(api_key=os.environ["MAPBOX_API_KEY"])
-
-        super(LocationCache, self).__init__(*args, **kwargs)
-
-    def __getitem__(self, key):
-        if key not in self:
-            location = self._geolocator.reverse(key)
-            if not location:
-                return
-            self[key] = ", ".join(
-                [
-                    l["text"]
-                    for l in location.raw["context"]
-                    if l["id"].startswith("place.")
-                    or l["id"].startswith("neighbourhood.")
-                    or l["id"].startswith("locality.")
-                ]
-            )
-
-        return super().__getitem__(key)
-
-
-locations = LocationCache()
+# cached report lines are rendered again when this changes
+REPORT_VERSION = 2
 
 
 def seconds_to_minutes(seconds):
@@ -50,173 +27,230 @@ def link(text, target):
     return f"\033]8;;{target}\033\\{text}\033]8;;\033\\"
 
 
-best = {"overall": None, "km": None, "consistency": None}
-best_efforts = {}
-
-client = Strava(os.environ["STRAVA_CLIENT_ID"], os.environ["STRAVA_CLIENT_SECRET"])
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    add_arguments(parser, "report on")
+    return parser.parse_args(argv)
 
-activity_type = "Run" if len(sys.argv) == 1 else sys.argv[1].capitalize()
 
-cache_path = Path(os.environ["XDG_CACHE_HOME"]) / (
-    "strava.cache"
-    if activity_type == "Run"
-    else f"strava.{activity_type.lower()}.cache"
-)
+def render_activities(activities, analytics, activity_type, locations):
+    """A line, and splits if any, for each activity, and whether it's final
 
-activity_cache = {}
-if cache_path.exists():
-    activity_cache = pickle.loads(cache_path.read_bytes())
+    A line isn't final if the place the activity started couldn't be
+    named, e.g. when offline."""
 
-page = 1
-while activities := client.get(
-    "/athlete/activities",
-    params={
-        # "after": int(datetime(2021, 4, 1).timestamp()),
-        "after": int(datetime(2010, 6, 1).timestamp()),
-        # "after": int(datetime(2018, 5, 24).timestamp()),
-        # "before": int(datetime(2018, 6, 26).timestamp()),
-        "page": page,
-    },
-):
-    page += 1
+    locations.prefetch(activity.start_latlng for activity in activities)
 
-    if "errors" in activities:
-        print(activities)
-        sys.exit(1)
+    rendered = []
+    for i, activity in enumerate(activities):
+        average_pace = seconds_to_minutes(1 / (analytics.average_speed[i] / 1000))
 
-    for activity in activities:
-        if activity["type"] != activity_type:
-            continue
+        location = locations[activity.start_latlng]
+        final = not activity.start_latlng or activity.start_latlng in locations
 
-        if activity["id"] in [49385397, 49451690, 294364499]:
-            continue
-
-        if activity["id"] in activity_cache:
-            activity = activity_cache[activity["id"]]
-        else:
-            activity = client.get(f"/activities/{activity['id']}")
-            activity_cache[activity["id"]] = activity
-
-        average_speed = activity["distance"] / activity["elapsed_time"]
-        average_pace = seconds_to_minutes(1 / (average_speed / 1000))
-
-        if activity["distance"] > 900:
-            if not best["overall"] or best["overall"]["average_speed"] < average_speed:
-                best["overall"] = {
-                    "average_speed": average_speed,
-                    "pace": average_pace,
-                    "start_date": activity["start_date"],
-                    "activity": activity,
-                }
-
-        location = locations[tuple([round(i, 2) for i in activity["start_latlng"]])]
-
-        if "best_efforts" in activity:
-            for effort in activity["best_efforts"]:
-                if effort["name"] not in best_efforts:
-                    best_efforts[effort["name"]] = []
-                effort["start_date"] = activity["start_date"]
-                effort["activity"] = activity
-                best_efforts[effort["name"]].append(effort)
-
-        print(
-            f"""{link(activity['start_date'].strftime("%a, %b %d, %Y"), 'https://www.strava.com/activities/'+str(activity['id']))} {activity["distance"]/1000:.2f}km in {seconds_to_minutes(activity["elapsed_time"])} ({average_pace}/km, 5k in {seconds_to_minutes(5000/activity["average_speed"])}){" — " + location if location else ""}{" — " + activity["description"] if activity["description"] else ""}"""
-        )
+        lines = [
+            f"""{link(activity.start_date.strftime("%a, %b %d, %Y"), 'https://www.strava.com/activities/'+str(activity.id))} {activity.distance/1000:.2f}km in {seconds_to_minutes(activity.elapsed_time)} ({average_pace}/km, 5k in {seconds_to_minutes(5000/activity.average_speed)}){" — " + location if location else ""}{" — " + activity.description if activity.description else ""}"""
+        ]
 
-        if "splits_metric" in activity and len(activity["splits_metric"]) > 1:
-            print(
-                "\tsplits",
-                ", ".join(
+        if analytics.has_splits[i]:
+            lines.append(
+                "\tsplits "
+                + ", ".join(
                     [
-                        seconds_to_minutes(1 / (split["average_speed"] / 1000))
+                        seconds_to_minutes(1 / (speed / 1000))
                         + (
-                            f" ({split['average_speed'] / 1000 * 3600:.2f}km/h)"
+                            f" ({speed / 1000 * 3600:.2f}km/h)"
                             if activity_type == "Ride"
                             else ""
                         )
-                        for split in activity["splits_metric"]
-                        if split["distance"] >= 900
+                        for speed in analytics.shown_speeds(i)
                     ]
-                ),
+                )
             )
 
-            splits = [
-                split
-                for split in activity["splits_metric"]
-                if split["distance"] >= 900
-                and (
-                    (
-                        activity_type == "Ride"
-                        and (split["distance"] / split["elapsed_time"]) <= 20
-                    )
-                    or (split["distance"] / split["elapsed_time"]) <= 4
-                )
-            ]
-            for split in splits:
-                split_average_speed = split["distance"] / (
-                    split["moving_time"]
-                    if activity_type == "Ride"
-                    else split["elapsed_time"]
+            if analytics.consistent[i]:
+                lines.append(
+                    f"\t\tfastest: {seconds_to_minutes(analytics.fastest[i])}, slowest: {seconds_to_minutes(analytics.slowest[i])}, average: {seconds_to_minutes(analytics.mean[i])}±{seconds_to_minutes(analytics.plus_minus[i])} (σ{seconds_to_minutes(analytics.stddev[i])})"
                 )
-                if not best["km"] or best["km"]["average_speed"] < split_average_speed:
-                    best["km"] = {
-                        "activity": activity,
-                        "average_speed": split_average_speed,
-                        "start_date": activity["start_date"],
-                        "pace": 1 / (split_average_speed / 1000),
-                    }
-
-            if len(splits) < 3:
-                continue
-            normalised_times = [1000 / (split["average_speed"]) for split in splits]
-            mean_split_time = sum(normalised_times) / len(normalised_times)
-            variance = sum([pow(x - mean_split_time, 2) for x in normalised_times]) / (
-                len(normalised_times) - 1
-            )
-            plus_minus = (
-                (max(normalised_times) - mean_split_time)
-                + (mean_split_time - min(normalised_times))
-            ) / 2
+                lines.append("")
+        else:
+            lines.append("")
+
+        rendered.append(("\n".join(lines), final))
+    return rendered
+
+
+def print_bests(index, activity_cache):
+    """Print the fastest activity, the fastest km and the most even splits"""
+
+    best = {"overall": None, "km": None, "consistency": None}
+
+    if (record := index.best("overall")) is not None:
+        activity_id, average_speed = record
+        activity = activity_cache[activity_id]
+        best["overall"] = {
+            "average_speed": average_speed,
+            "pace": seconds_to_minutes(1 / (average_speed / 1000)),
+            "start_date": activity.start_date,
+            "activity": activity,
+        }
+
+    if (record := index.best("km")) is not None:
+        activity_id, split_average_speed = record
+        activity = activity_cache[activity_id]
+        best["km"] = {
+            "activity": activity,
+            "average_speed": split_average_speed,
+            "start_date": activity.start_date,
+            "pace": 1 / (split_average_speed / 1000),
+        }
+
+    if (record := index.best("consistency")) is not None:
+        activities = [activity_cache[record[0]]]
+        analytics = SplitAnalytics(activities, activity_cache.activity_type)
+        i = 0
+        best["consistency"] = {
+            "activity": activities[i],
+            "variance": analytics.variance[i],
+            "stddev": seconds_to_minutes(analytics.stddev[i]),
+            "start_date": activities[i].start_date,
+            "pace": seconds_to_minutes(1 / (analytics.average_speed[i] / 1000)),
+            "splits": analytics.splits(i),
+            "min": seconds_to_minutes(analytics.fastest[i]),
+            "max": seconds_to_minutes(analytics.slowest[i]),
+            "diff": seconds_to_minutes(analytics.slowest[i] - analytics.fastest[i]),
+            "average": seconds_to_minutes(analytics.mean[i]),
+            "plus_minus": seconds_to_minutes(analytics.plus_minus[i]),
+        }
+
+    # none if, say, no activity has splits
+    if best["km"]:
+        print(
+            f"""Best split: {seconds_to_minutes(best['km']['pace'])}/km on {link(best['km']['start_date'].strftime('%a, %b %d, %Y'), "https://www.strava.com/activities/"+str(best['km']['activity'].id))}"""
+        )
+    if best["overall"]:
+        print(
+            f"""Best overall: {best['overall']['pace']}/km ({best['overall']['activity'].distance/1000:.1f}km in {seconds_to_minutes(best['overall']['activity'].elapsed_time)}) on {link(best['overall']['start_date'].strftime('%a, %b %d, %Y'), "https://www.strava.com/activities/"+str(best["overall"]["activity"].id))}"""
+        )
+    if best["consistency"]:
+        print(
+            f"""Most consistent: {best['consistency']['pace']}/km ({best['consistency']['activity'].distance/1000:.1f}km in {seconds_to_minutes(best['consistency']['activity'].elapsed_time)}) on {link(best['consistency']['start_date'].strftime('%a, %b %d, %Y'), "https://www.strava.com/activities/"+str(best["consistency"]["activity"].id))}\n\tsplits: {', '.join([seconds_to_minutes(split) for split in best['consistency']['splits']])}; fastest: {best['consistency']['min']}, slowest: {best['consistency']['max']}, average: {best["consistency"]["average"]}±{best["consistency"]["plus_minus"]} (σ{best["consistency"]["stddev"]})"""
+        )
+
 
+def print_best_efforts(leaderboard):
+    print("Best efforts:")
+    for effort_type in leaderboard.names():
+        efforts = leaderboard.top(effort_type)
+        delimiter = "\n\t\t"
+        print(
+            f"""\t{effort_type}:{delimiter}{delimiter.join([seconds_to_minutes(effort["elapsed_time"]) + " on " + link(effort['start_date'].strftime("%a, %b %d, %Y"), "https://www.strava.com/activities/"+str(effort["activity_id"])) for effort in efforts])}"""
+        )
+
+
+def print_routes(route_index, locations, n=10):
+    """Print the fastest times on each of the n most often followed routes"""
+
+    print("Routes:")
+    for route, count, distance, start in route_index.routes(n):
+        place = locations[start]
+        delimiter = "\n\t\t"
+        print(
+            f"""\t{distance/1000:.1f}km{" from " + place if place else ""}, {count} times:{delimiter}{delimiter.join([seconds_to_minutes(activity["elapsed_time"]) + " on " + link(activity['start_date'].strftime("%a, %b %d, %Y"), "https://www.strava.com/activities/"+str(activity["activity_id"])) for activity in route_index.top(route)])}"""
+        )
+
+
+def hours_minutes(seconds):
+    return f"{int(seconds // 3600)}h{int(seconds % 3600 // 60):02}m"
+
+
+def print_totals(index):
+    """Print totals for each year, and the latest months and weeks"""
+
+    for title, period, n in [
+        ("Totals by year", "year", None),
+        ("Totals by month", "month", 12),
+        ("Totals by week", "week", 8),
+    ]:
+        print(f"{title}:")
+        for start, count, distance, moving_time, elapsed_time in index.periods(
+            period, n
+        ):
             print(
-                f"\t\tfastest: {seconds_to_minutes(min(normalised_times))}, slowest: {seconds_to_minutes(max(normalised_times))}, average: {seconds_to_minutes(mean_split_time)}±{seconds_to_minutes(plus_minus)} (σ{seconds_to_minutes(sqrt(variance))})"
+                f"\t{start}: {count} {'activity' if count == 1 else 'activities'}, {distance/1000:.1f}km in {hours_minutes(elapsed_time)} ({hours_minutes(moving_time)} moving)"
             )
 
-            if not best["consistency"] or best["consistency"]["variance"] > variance:
-                best["consistency"] = {
-                    "activity": activity,
-                    "variance": variance,
-                    "stddev": seconds_to_minutes(sqrt(variance)),
-                    "start_date": activity["start_date"],
-                    "pace": average_pace,
-                    "splits": normalised_times,
-                    "min": seconds_to_minutes(min(normalised_times)),
-                    "max": seconds_to_minutes(max(normalised_times)),
-                    "diff": seconds_to_minutes(
-                        max(normalised_times) - min(normalised_times)
-                    ),
-                    "average": seconds_to_minutes(mean_split_time),
-                    "plus_minus": seconds_to_minutes(plus_minus),
-                }
-
-        print()
-
-print(
-    f"""Best split: {seconds_to_minutes(best['km']['pace'])}/km on {link(best['km']['start_date'].strftime('%a, %b %d, %Y'), "https://www.strava.com/activities/"+str(best['km']['activity']['id']))}"""
-)
-print(
-    f"""Best overall: {best['overall']['pace']}/km ({best['overall']['activity']['distance']/1000:.1f}km in {seconds_to_minutes(best['overall']['activity']['elapsed_time'])}) on {link(best['overall']['start_date'].strftime('%a, %b %d, %Y'), "https://www.strava.com/activities/"+str(best["overall"]["activity"]["id"]))}"""
-)
-print(
-    f"""Most consistent: {best['consistency']['pace']}/km ({best['consistency']['activity']['distance']/1000:.1f}km in {seconds_to_minutes(best['consistency']['activity']['elapsed_time'])}) on {link(best['consistency']['start_date'].strftime('%a, %b %d, %Y'), "https://www.strava.com/activities/"+str(best["consistency"]["activity"]["id"]))}\n\tsplits: {', '.join([seconds_to_minutes(split) for split in best['consistency']['splits']])}; fastest: {best['consistency']['min']}, slowest: {best['consistency']['max']}, average: {best["consistency"]["average"]}±{best["consistency"]["plus_minus"]} (σ{best["consistency"]["stddev"]})"""
-)
-
-print("Best efforts:")
-for effort_type, efforts in best_efforts.items():
-    efforts.sort(key=lambda d: (d["elapsed_time"], -d["start_date"].timestamp()))
-    delimiter = "\n\t\t"
-    print(
-        f"""\t{effort_type}:{delimiter}{delimiter.join([seconds_to_minutes(effort["elapsed_time"]) + " on " + link(effort['start_date'].strftime("%a, %b %d, %Y"), "https://www.strava.com/activities/"+str(effort["activity"]["id"])) for effort in efforts[0:5]  ])}"""
-    )
-
-cache_path.write_bytes(pickle.dumps(activity_cache))
+
+def report(index, route_index, activity_cache, locations):
+    """Print the full report for one activity type, updating its indexes first"""
+
+    with stats.phase("summarise"):
+        index.update()
+        route_index.update()
+
+    with stats.phase("report"):
+        for text in index.lines():
+            print(text)
+
+        print_bests(index, activity_cache)
+        print_best_efforts(index.leaderboard)
+        print_routes(route_index, locations)
+        print_totals(index)
+
+
+def main(argv=None, rate_limiter=None):
+    load_dotenv()
+    args = parse_args(argv)
+    try:
+        synced = SyncedCaches(args, datetime(2010, 6, 1).astimezone(), rate_limiter)
+        cache_dir = synced.cache_dir
+
+        locations = LocationCache(
+            cache_dir / "strava.sqlite",
+            None if args.offline else MapBoxGeocoder(os.environ["MAPBOX_API_KEY"]),
+        )
+        streams = StreamCache(cache_dir / "strava.sqlite", synced.client)
+        indexes = {}
+        for activity_type, activity_cache in synced.activity_caches.items():
+            distances = efforts_for(activity_type, args.efforts)
+            indexes[activity_type] = SummaryIndex(
+                cache_dir / "strava.sqlite",
+                activity_cache,
+                functools.partial(
+                    render_activities, activity_type=activity_type, locations=locations
+                ),
+                efforts=functools.partial(streams.best_efforts, distances=distances),
+                version=(REPORT_VERSION, distances),
+            )
+        route_indexes = {
+            activity_type: RouteIndex(cache_dir / "strava.sqlite", activity_cache)
+            for activity_type, activity_cache in synced.activity_caches.items()
+        }
+
+        with profiled(args.profile):
+            for activity_type, activity_cache in synced.activity_caches.items():
+                if len(synced.activity_types) > 1:
+                    print(f"# {activity_type}\n")
+
+                report(
+                    indexes[activity_type],
+                    route_indexes[activity_type],
+                    activity_cache,
+                    locations,
+                )
+
+                if len(synced.activity_types) > 1:
+                    print()
+
+        with stats.phase("save"):
+            synced.close()
+            for index in [*indexes.values(), *route_indexes.values()]:
+                index.close()
+            locations.close()
+            streams.close()
+    finally:
+        stats.finish()
+
+
+if __name__ == "__main__":
+    main()
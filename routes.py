@@ -0,0 +1,303 @@
+import sqlite3
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import numpy as np
+
+# grid cells are this many degrees of latitude high, about 110m, and as wide
+CELL_SIZE = 0.001
+# bumped whenever route_cells() numbers cells differently, so that saved
+# routes are rebuilt
+GRID_VERSION = 2
+
+
+def decode_polyline(encoded):
+    """(lat, lng) array from Google's encoded polyline format"""
+
+    values = []
+    value = shift = 0
+    for char in encoded.encode():
+        byte = char - 63
+        value |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+
+    deltas = np.array(values[: len(values) // 2 * 2], dtype=np.int64).reshape(-1, 2)
+    return np.cumsum(deltas, axis=0) / 1e5
+
+
+def route_cells(points, cell_size=CELL_SIZE):
+    """Grid cells a route passes through, as a sorted array of cell ids
+
+    Each stretch between points is sampled at least twice per cell, so that
+    sparse stretches don't skip over cells. The grid is the same for every
+    route: rows are cell_size degrees of latitude high, and each row is cut
+    into cells about as wide as they are high at the middle of it. Cells
+    are numbered by row and column in one int64."""
+
+    if not len(points):
+        return np.empty(0, dtype=np.int64)
+
+    deltas = np.diff(points, axis=0)
+    # roughly how many cells each stretch crosses, either way
+    crossed = np.abs(deltas) / cell_size
+    crossed[:, 1] *= np.cos(np.radians(points[:-1, 0]))
+    steps = np.maximum(1, np.ceil(crossed.max(axis=1, initial=0) * 2))
+    steps = steps.astype(np.int64)
+    stretch = np.repeat(np.arange(len(deltas)), steps)
+    fraction = (
+        np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+    ) / steps[stretch]
+    samples = np.concatenate(
+        [points[stretch] + deltas[stretch] * fraction[:, None], points[-1:]]
+    )
+
+    rows = np.floor(samples[:, 0] / cell_size)
+    columns = np.floor(
+        samples[:, 1] * np.cos(np.radians((rows + 0.5) * cell_size)) / cell_size
+    )
+    return np.unique(rows.astype(np.int64) * 2**32 + columns.astype(np.int64))
+
+
+class RouteIndex:
+    """Activities grouped by the route they follow, for one activity type
+
+    Every route is the grid cells its first activity passed through, and
+    an inverted index from cell to routes finds those an activity shares
+    any cells with, so it's only compared with those. It joins the one it
+    overlaps most, by the share of their combined cells in common, if that
+    is at least overlap and their distances are within tolerance of each
+    other; otherwise it starts a new route. Routes therefore run in either
+    direction, but an out-and-back isn't mistaken for its outward half.
+
+    Persisted next to the activities, and brought up to date by update(),
+    which only looks at activities written or deleted since it last ran, as
+    SummaryIndex does."""
+
+    def __init__(self, path, activity_cache, overlap=0.6, tolerance=0.1):
+        self.activity_type = activity_cache.activity_type
+        self._activity_cache = activity_cache
+        self.overlap = overlap
+        self.tolerance = tolerance
+        self._version = str((GRID_VERSION, CELL_SIZE, overlap, tolerance))
+
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS route_state (
+                    type TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    version TEXT NOT NULL
+                )""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS routes (
+                    id INTEGER PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    distance REAL NOT NULL,
+                    lat REAL NOT NULL,
+                    lng REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS route_cells (
+                    cell INTEGER NOT NULL,
+                    route INTEGER NOT NULL,
+                    PRIMARY KEY (cell, route)
+                ) WITHOUT ROWID""")
+            # for dropping a route's cells
+            self._db.execute("""CREATE INDEX IF NOT EXISTS route_cells_route
+                    ON route_cells (route)""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS route_activities (
+                    id INTEGER PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    route INTEGER NOT NULL,
+                    elapsed_time INTEGER NOT NULL,
+                    start_timestamp REAL NOT NULL,
+                    start_date TEXT NOT NULL
+                )""")
+            self._db.execute("""CREATE INDEX IF NOT EXISTS route_activities_time
+                    ON route_activities (route, elapsed_time, start_timestamp DESC)""")
+
+        row = self._db.execute(
+            "SELECT seq, version FROM route_state WHERE type = ?",
+            (self.activity_type,),
+        ).fetchone()
+        self._seq = row[0] if row and row[1] == self._version else None
+
+        # cell -> routes through it, and each route's (distance, size), loaded
+        # only when there's something to match
+        self._cells = None
+        self._routes = None
+
+    def _load(self):
+        self._cells = defaultdict(list)
+        for cell, route in self._db.execute(
+            """SELECT cell, route FROM route_cells
+                JOIN routes ON routes.id = route WHERE type = ?""",
+            (self.activity_type,),
+        ):
+            self._cells[cell].append(route)
+        self._routes = {
+            route: (distance, size)
+            for route, distance, size in self._db.execute(
+                "SELECT id, distance, size FROM routes WHERE type = ?",
+                (self.activity_type,),
+            )
+        }
+
+    def update(self, batch_size=500):
+        """Catch up with changes to the activities; returns how many there were"""
+
+        seq, changed = self._activity_cache.changes(self._seq)
+        if self._seq is None:
+            with self._db:
+                self._db.execute(
+                    """DELETE FROM route_cells WHERE route IN
+                        (SELECT id FROM routes WHERE type = ?)""",
+                    (self.activity_type,),
+                )
+                for table in ["routes", "route_activities"]:
+                    self._db.execute(
+                        f"DELETE FROM {table} WHERE type = ?", (self.activity_type,)
+                    )
+
+        if changed:
+            self._load()
+        for start in range(0, len(changed), batch_size):
+            batch = changed[start : start + batch_size]
+            with self._db:
+                self._remove(batch)
+                for activity in self._activity_cache.get_many(batch):
+                    self._add(activity)
+
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO route_state VALUES (?, ?, ?)",
+                (self.activity_type, seq, self._version),
+            )
+        self._seq = seq
+        return len(changed)
+
+    def _remove(self, activity_ids):
+        placeholders = ", ".join("?" * len(activity_ids))
+        routes = {
+            row[0]
+            for row in self._db.execute(
+                f"""SELECT route FROM route_activities
+                    WHERE type = ? AND id IN ({placeholders})""",
+                (self.activity_type, *activity_ids),
+            )
+        }
+        self._db.execute(
+            f"DELETE FROM route_activities WHERE type = ? AND id IN ({placeholders})",
+            (self.activity_type, *activity_ids),
+        )
+
+        # routes no activity follows any more
+        for route in routes:
+            if self._db.execute(
+                "SELECT 1 FROM route_activities WHERE route = ? LIMIT 1", (route,)
+            ).fetchone():
+                continue
+            cells = [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT cell FROM route_cells WHERE route = ?", (route,)
+                )
+            ]
+            for cell in cells:
+                self._cells[cell].remove(route)
+            del self._routes[route]
+            self._db.execute("DELETE FROM route_cells WHERE route = ?", (route,))
+            self._db.execute("DELETE FROM routes WHERE id = ?", (route,))
+
+    def _match(self, cells, distance):
+        shared = Counter(
+            route for cell in cells.tolist() for route in self._cells.get(cell, ())
+        )
+        best, best_overlap = None, self.overlap
+        for route, count in shared.items():
+            route_distance, size = self._routes[route]
+            if abs(distance - route_distance) > self.tolerance * route_distance:
+                continue
+            overlap = count / (len(cells) + size - count)
+            if overlap >= best_overlap:
+                best, best_overlap = route, overlap
+        return best
+
+    def _add(self, activity):
+        if not activity.polyline:
+            return
+        points = decode_polyline(activity.polyline)
+        cells = route_cells(points)
+        if not len(cells):
+            return
+
+        route = self._match(cells, activity.distance)
+        if route is None:
+            route = self._db.execute(
+                "INSERT INTO routes (type, distance, lat, lng, size)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    self.activity_type,
+                    activity.distance,
+                    *points[0].tolist(),
+                    len(cells),
+                ),
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO route_cells VALUES (?, ?)",
+                [(cell, route) for cell in cells.tolist()],
+            )
+            for cell in cells.tolist():
+                self._cells[cell].append(route)
+            self._routes[route] = (activity.distance, len(cells))
+
+        self._db.execute(
+            "INSERT OR REPLACE INTO route_activities VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                activity.id,
+                self.activity_type,
+                route,
+                activity.elapsed_time,
+                activity.start_date.timestamp(),
+                activity.start_date.isoformat(),
+            ),
+        )
+
+    def routes(self, n=None, min_count=2):
+        """Routes followed at least min_count times, most often first
+
+        As (route, count, distance, start), where distance and start, as
+        (lat, lng), are those of the route's first activity."""
+
+        return [
+            (route, count, distance, (lat, lng))
+            for route, count, distance, lat, lng in self._db.execute(
+                """SELECT route, COUNT(*), distance, lat, lng
+                    FROM route_activities JOIN routes ON routes.id = route
+                    WHERE route_activities.type = ?
+                    GROUP BY route HAVING COUNT(*) >= ?
+                    ORDER BY COUNT(*) DESC, route LIMIT ?""",
+                (self.activity_type, min_count, -1 if n is None else n),
+            )
+        ]
+
+    def top(self, route, n=5):
+        """The n fastest activities on a route; ties go to the more recent"""
+
+        return [
+            {
+                "elapsed_time": elapsed_time,
+                "activity_id": activity_id,
+                "start_date": datetime.fromisoformat(start_date),
+            }
+            for elapsed_time, activity_id, start_date in self._db.execute(
+                """SELECT elapsed_time, id, start_date FROM route_activities
+                    WHERE route = ?
+                    ORDER BY elapsed_time, start_timestamp DESC LIMIT ?""",
+                (route, n),
+            )
+        ]
+
+    def close(self):
+        self._db.close()
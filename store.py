@@ -0,0 +1,218 @@
+import pickle
+import sqlite3
+import zlib
+
+from records import Activity
+
+
+class ActivityStore:
+    """Cache of detailed activities of one type, backed by SQLite
+
+    Behaves like the dict of activities by id that it replaces, but writes are
+    committed immediately and lookups don't need the whole history in memory.
+    The database itself holds every activity type.
+
+    Activities are stored as compact Activity records. Unless keep_raw is
+    false, the full JSON from Strava is also kept, compressed in a separate
+    table, and only read by raw().
+
+    Every write and deletion is also logged, so that anything derived from
+    the activities can catch up with changes(); see SummaryIndex."""
+
+    def __init__(self, path, activity_type, keep_raw=True):
+        self.activity_type = activity_type
+        self.keep_raw = keep_raw
+
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS activities (
+                    id INTEGER PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    start_date REAL NOT NULL,
+                    data BLOB NOT NULL
+                )""")
+            self._db.execute("""CREATE INDEX IF NOT EXISTS activities_type_start_date
+                    ON activities (type, start_date)""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS raw_activities (
+                    id INTEGER PRIMARY KEY,
+                    data BLOB NOT NULL
+                )""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS activity_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id INTEGER NOT NULL
+                )""")
+
+        self._migrate(path.parent)
+        self._project()
+
+    def _migrate(self, cache_dir):
+        """Import the whole-file pickle caches used previously
+
+        Each is renamed once imported, so this only happens once."""
+
+        for cache_path in [
+            cache_dir / "strava.cache",
+            *cache_dir.glob("strava.*.cache"),
+        ]:
+            if not cache_path.exists():
+                continue
+            with self._db:
+                for activity in pickle.loads(cache_path.read_bytes()).values():
+                    if activity["id"] not in self:
+                        self._write(activity)
+            cache_path.rename(cache_path.with_suffix(".cache.migrated"))
+
+    def _project(self):
+        """Replace any full JSON activities stored previously with records"""
+
+        if self._db.execute("PRAGMA user_version").fetchone()[0] >= 1:
+            return
+        with self._db:
+            for (data,) in self._db.execute("SELECT data FROM activities").fetchall():
+                activity = pickle.loads(data)
+                if isinstance(activity, dict):
+                    self._write(activity)
+            self._db.execute("PRAGMA user_version = 1")
+
+    def _write(self, activity):
+        if isinstance(activity, dict):
+            if self.keep_raw:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO raw_activities VALUES (?, ?)",
+                    (activity["id"], zlib.compress(pickle.dumps(activity))),
+                )
+            activity = Activity.from_json(activity)
+
+        self._db.execute(
+            "INSERT OR REPLACE INTO activities VALUES (?, ?, ?, ?)",
+            (
+                activity.id,
+                activity.type,
+                activity.start_date.timestamp(),
+                pickle.dumps(activity),
+            ),
+        )
+        self._db.execute("INSERT INTO activity_log (id) VALUES (?)", (activity.id,))
+
+    def __contains__(self, activity_id):
+        return (
+            self._db.execute(
+                "SELECT 1 FROM activities WHERE id = ? AND type = ?",
+                (activity_id, self.activity_type),
+            ).fetchone()
+            is not None
+        )
+
+    def __getitem__(self, activity_id):
+        row = self._db.execute(
+            "SELECT data FROM activities WHERE id = ? AND type = ?",
+            (activity_id, self.activity_type),
+        ).fetchone()
+        if row is None:
+            raise KeyError(activity_id)
+        return pickle.loads(row[0])
+
+    def __setitem__(self, activity_id, activity):
+        """Store an Activity, or the JSON for one as returned by Strava"""
+
+        with self._db:
+            self._write(activity)
+
+    def __delitem__(self, activity_id):
+        with self._db:
+            if self._db.execute(
+                "DELETE FROM activities WHERE id = ? AND type = ?",
+                (activity_id, self.activity_type),
+            ).rowcount:
+                self._db.execute(
+                    "DELETE FROM raw_activities WHERE id = ?", (activity_id,)
+                )
+                self._db.execute(
+                    "INSERT INTO activity_log (id) VALUES (?)", (activity_id,)
+                )
+
+    def changes(self, since=None):
+        """Ids of activities written or deleted since a point in the log
+
+        Returns the current point and the ids, of any type, changed after
+        since; or, if since is None, every id of this type. Pass the point
+        returned to the next call."""
+
+        seq = self._db.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM activity_log"
+        ).fetchone()[0]
+        if since is None:
+            return seq, list(self)
+        return seq, [
+            row[0]
+            for row in self._db.execute(
+                "SELECT DISTINCT id FROM activity_log WHERE seq > ? AND seq <= ?",
+                (since, seq),
+            )
+        ]
+
+    def get_many(self, activity_ids):
+        """Those of activity_ids that are activities of this type, by date"""
+
+        activity_ids = list(activity_ids)
+        rows = []
+        # within SQLite's limit on the number of parameters
+        for start in range(0, len(activity_ids), 500):
+            chunk = activity_ids[start : start + 500]
+            rows += self._db.execute(
+                f"""SELECT start_date, data FROM activities
+                    WHERE type = ? AND id IN ({", ".join("?" * len(chunk))})""",
+                (self.activity_type, *chunk),
+            ).fetchall()
+        return [pickle.loads(data) for _, data in sorted(rows)]
+
+    def raw(self, activity_id):
+        """The full JSON of an activity as last fetched, if it was kept"""
+
+        row = self._db.execute(
+            "SELECT data FROM raw_activities WHERE id = ?", (activity_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def __len__(self):
+        return self._db.execute(
+            "SELECT COUNT(*) FROM activities WHERE type = ?", (self.activity_type,)
+        ).fetchone()[0]
+
+    def __iter__(self):
+        return (
+            row[0]
+            for row in self._db.execute(
+                "SELECT id FROM activities WHERE type = ? ORDER BY start_date",
+                (self.activity_type,),
+            ).fetchall()
+        )
+
+    def scan(self, after=None, before=None):
+        """Activities in date order, optionally limited to a date range"""
+
+        query = "SELECT data FROM activities WHERE type = ?"
+        params = [self.activity_type]
+        if after is not None:
+            query += " AND start_date >= ?"
+            params.append(after.timestamp())
+        if before is not None:
+            query += " AND start_date < ?"
+            params.append(before.timestamp())
+        query += " ORDER BY start_date"
+
+        for row in self._db.execute(query, params):
+            yield pickle.loads(row[0])
+
+    def values(self):
+        return self.scan()
+
+    def items(self):
+        return ((activity.id, activity) for activity in self.scan())
+
+    def close(self):
+        self._db.close()
@@ -3,32 +3,40 @@
 import functools
 import json
 import os
+import queue
 import socket
 import subprocess
 import sys
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from random import randrange
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from instrumentation import endpoint, stats
+
+
+@functools.lru_cache(maxsize=None)
+def _timezone(utc_offset):
+    return timezone(timedelta(seconds=utc_offset))
 
 
 def _fix_single_date(item):
+    """Replace start_date with the local start time, offset from UTC
+
+    Strava gives start_date_local as local wall-clock time but suffixed "Z",
+    and the offset separately, in seconds, as utc_offset. The item is updated
+    in place: it has only just been decoded from the response."""
+
     if "start_date" in item and "start_date_local" in item:
-        if "utc_offset" in item:
-            if item["utc_offset"] >= 0:
-                item["start_date_local"] = item["start_date_local"].replace(
-                    "Z", f"+{item['utc_offset'] / 3600 * 100:04.0f}"
-                )
-            else:
-                item["start_date_local"] = item["start_date_local"].replace(
-                    "Z", f"{item['utc_offset'] / 3600 * 100:05.0f}"
-                )
-        item["start_date"] = datetime.strptime(
-            item["start_date_local"], "%Y-%m-%dT%H:%M:%S%z"
-        )
-        del item["start_date_local"]
+        local = datetime.fromisoformat(item.pop("start_date_local").removesuffix("Z"))
+        item["start_date"] = local.replace(tzinfo=_timezone(item.get("utc_offset", 0)))
     return item
 
 
@@ -36,7 +44,7 @@ def _fix_dates(func):
     @functools.wraps(func)
     def decorated_func(*args, **kwargs):
         data = func(*args, **kwargs)
-        if type(data).__name__ == "list":
+        if isinstance(data, list):
             return [_fix_single_date(item) for item in data]
         else:
             return _fix_single_date(data)
@@ -44,6 +52,78 @@ def _fix_dates(func):
     return decorated_func
 
 
+class RateLimiter:
+    """Pause requests before Strava's rate limits are exceeded
+
+    Strava reports the limit and current usage for the 15-minute and daily
+    windows in every response; between responses, requests made are counted
+    locally so that concurrent workers don't all slip past the limit.
+
+    The limits apply to the application (client id) as a whole, so several
+    processes using the same one can share the count: pass each of them the
+    same shared, from shared_state() with a multiprocessing manager."""
+
+    def __init__(self, headroom=5, shared=None):
+        self.headroom = headroom
+        if shared is None:
+            shared = {"limit": None, "usage": None}, threading.Lock()
+        self._state, self._lock = shared
+
+    @staticmethod
+    def shared_state(manager):
+        return manager.dict(limit=None, usage=None), manager.Lock()
+
+    @property
+    def limit(self):
+        return self._state["limit"]
+
+    @property
+    def usage(self):
+        return self._state["usage"]
+
+    def update(self, headers):
+        if "X-RateLimit-Limit" not in headers or "X-RateLimit-Usage" not in headers:
+            return
+        limit = [int(i) for i in headers["X-RateLimit-Limit"].split(",")]
+        usage = [int(i) for i in headers["X-RateLimit-Usage"].split(",")]
+        with self._lock:
+            self._state["limit"] = limit
+            self._state["usage"] = usage
+        stats.rate_limit(limit, usage)
+
+    def wait(self):
+        with self._lock:
+            limit, usage = self._state["limit"], self._state["usage"]
+            if not limit:
+                return
+
+            now = datetime.now(timezone.utc)
+            if usage[1] + self.headroom >= limit[1]:
+                resume = (now + timedelta(days=1)).replace(
+                    hour=0, minute=0, second=0, microsecond=0
+                )
+                usage = [0, 0]
+            elif usage[0] + self.headroom >= limit[0]:
+                # the start of the next quarter-hour window
+                resume = now.replace(
+                    minute=now.minute // 15 * 15, second=0, microsecond=0
+                ) + timedelta(minutes=15)
+                usage = [0, usage[1]]
+            else:
+                resume = None
+
+            if resume:
+                print(
+                    f"Rate limit nearly reached, pausing until {resume.astimezone():%H:%M}",
+                    file=sys.stderr,
+                )
+                time.sleep((resume - now).total_seconds())
+
+            # reassigned rather than changed in place, as a shared state
+            # only sees assignments
+            self._state["usage"] = [i + 1 for i in usage]
+
+
 class Strava:
     class OneOffHTTPRequestHandler(BaseHTTPRequestHandler):
         def do_GET(self):
@@ -67,29 +147,42 @@ class Strava:
             except:
                 return False
 
-    def __init__(self, client_id, client_secret):
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        base_url="https://www.strava.com/api/v3",
+        max_workers=8,
+        token_file=None,
+        rate_limiter=None,
+    ):
         self.client_id = client_id
         self.client_secret = client_secret
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or RateLimiter()
         self.token = {}
 
-        self._token_file = Path(os.environ["XDG_CACHE_HOME"]) / "strava_token"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_maxsize=max_workers,
+            max_retries=Retry(
+                total=5,
+                backoff_factor=1,
+                status_forcelist=[429, 500, 502, 503, 504],
+                respect_retry_after_header=True,
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._token_lock = threading.Lock()
+
+        self._token_file = token_file or (
+            Path(os.environ["XDG_CACHE_HOME"]) / "strava_token"
+        )
         if self._token_file.exists():
             self.token = json.loads(self._token_file.read_text())
-            if self.token["expires_at"] < datetime.now().timestamp():
-                self.token = requests.post(
-                    "https://www.strava.com/api/v3/oauth/token",
-                    data={
-                        "client_id": self.client_id,
-                        "client_secret": self.client_secret,
-                        "refresh_token": self.token["refresh_token"],
-                        "grant_type": "refresh_token",
-                    },
-                ).json()
-                if "access_token" in self.token:
-                    self._token_file.write_text(json.dumps(self.token))
-                else:
-                    print(self.token)
-                    sys.exit(1)
+            self._refresh_token()
         else:
             port = randrange(49152, 65535)
             while not self._try_port(port):
@@ -103,8 +196,8 @@ class Strava:
             httpd.serve_forever()
             auth_params = httpd.result
 
-            self.token = requests.post(
-                "https://www.strava.com/api/v3/oauth/token",
+            self.token = self.session.post(
+                f"{self.base_url}/oauth/token",
                 data={
                     "client_id": self.client_id,
                     "client_secret": self.client_secret,
@@ -118,16 +211,148 @@ class Strava:
                 print(self.token)
                 sys.exit(1)
 
+    def _refresh_token(self, force=False, token=None):
+        """Refresh the access token if it has expired or is about to
+
+        Safe to call from several threads at once: only the first caller
+        refreshes, unless the token it saw is still the current one."""
+
+        with self._token_lock:
+            if token is not None and token is not self.token:
+                return
+            if not force and self.token["expires_at"] - 300 > time.time():
+                return
+
+            with stats.timed_request("POST /oauth/token"):
+                self.token = self.session.post(
+                    f"{self.base_url}/oauth/token",
+                    data={
+                        "client_id": self.client_id,
+                        "client_secret": self.client_secret,
+                        "refresh_token": self.token["refresh_token"],
+                        "grant_type": "refresh_token",
+                    },
+                ).json()
+            if "access_token" in self.token:
+                self._token_file.write_text(json.dumps(self.token))
+            else:
+                print(self.token)
+                sys.exit(1)
+
     @_fix_dates
     def get(self, url, *args, **kwargs):
         """Fetch API endpoint response
 
-        Wraps requests.get to handle authentication etc"""
+        Wraps requests.get to handle authentication, retries etc"""
 
-        auth_header = {"Authorization": f"Bearer {self.token['access_token']}"}
         if "headers" not in kwargs:
             kwargs["headers"] = {}
-        kwargs["headers"].update(auth_header)
-        return requests.get(
-            f"https://www.strava.com/api/v3{url}", *args, **kwargs
-        ).json()
+
+        for attempt in range(2):
+            self._refresh_token()
+            token = self.token
+            kwargs["headers"]["Authorization"] = f"Bearer {token['access_token']}"
+
+            self.rate_limiter.wait()
+            start = time.perf_counter()
+            response = self.session.get(f"{self.base_url}{url}", *args, **kwargs)
+            stats.request(
+                endpoint("GET", url),
+                time.perf_counter() - start,
+                len(response.content),
+            )
+            self.rate_limiter.update(response.headers)
+
+            if response.status_code != 401:
+                break
+            # revoked or expired early: refresh once and try again
+            self._refresh_token(force=True, token=token)
+
+        return response.json()
+
+    def get_many(self, urls):
+        """Fetch several API endpoints concurrently
+
+        Returns the responses in the same order as urls"""
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.get, urls))
+
+    def get_streams(self, activity_ids, keys=("time", "distance")):
+        """Fetch the streams of several activities concurrently
+
+        Each response maps the stream types in keys to their data"""
+
+        return self.get_many(
+            f"/activities/{activity_id}/streams?keys={','.join(keys)}"
+            "&key_by_type=true"
+            for activity_id in activity_ids
+        )
+
+    def iter_activities(self, params=None, details=None, prefetch=2):
+        """Page through /athlete/activities in the background
+
+        Yields (summary, activity) for every activity listed, where activity
+        is the detailed /activities/{id} response if details(summary) is
+        true, or else None. Later pages and their details are fetched while
+        earlier ones are consumed, up to prefetch pages ahead."""
+
+        pages = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce():
+            try:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    page = 1
+                    while not stop.is_set() and (
+                        activities := self.get(
+                            "/athlete/activities",
+                            params={**(params or {}), "page": page},
+                        )
+                    ):
+                        page += 1
+
+                        if "errors" in activities:
+                            put(activities)
+                            return
+
+                        put(
+                            [
+                                (
+                                    summary,
+                                    (
+                                        executor.submit(
+                                            self.get, f"/activities/{summary['id']}"
+                                        )
+                                        if details and details(summary)
+                                        else None
+                                    ),
+                                )
+                                for summary in activities
+                            ]
+                        )
+                put(None)
+            except Exception as e:
+                put(e)
+
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            while (activities := pages.get()) is not None:
+                if isinstance(activities, Exception):
+                    raise activities
+                if "errors" in activities:
+                    print(activities)
+                    sys.exit(1)
+
+                for summary, activity in activities:
+                    yield summary, activity.result() if activity else None
+        finally:
+            stop.set()
@@ -0,0 +1,314 @@
+import argparse
+import re
+import sqlite3
+import zlib
+from itertools import islice
+
+import numpy as np
+
+from instrumentation import stats
+
+# Strava's own best efforts for runs, in metres
+NAMED_DISTANCES = {
+    "400m": 400,
+    "1/2 mile": 805,
+    "1k": 1000,
+    "1 mile": 1609,
+    "2 mile": 3219,
+    "5k": 5000,
+    "10k": 10000,
+    "15k": 15000,
+    "10 mile": 16093,
+    "20k": 20000,
+    "Half-Marathon": 21097,
+    "30k": 30000,
+    "Marathon": 42195,
+    "50k": 50000,
+}
+
+# types Strava works out best efforts for itself
+STRAVA_EFFORTS = {"Run"}
+
+DEFAULT_EFFORTS = {
+    "Run": list(NAMED_DISTANCES),
+    "Ride": ["5k", "10k", "20k", "40k", "50k", "100k"],
+}
+
+_UNITS = {"m": 1, "k": 1000, "km": 1000, "mi": 1609.344, "mile": 1609.344}
+
+
+def parse_distance(text):
+    """(name, metres) for e.g. "3k", "800m", "2 mile" or "Half-Marathon" """
+
+    text = text.strip()
+    if text in NAMED_DISTANCES:
+        return text, NAMED_DISTANCES[text]
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*(m|km?|mi(?:les?)?)", text)
+    if not match:
+        raise argparse.ArgumentTypeError(f"not a distance: {text!r}")
+    unit = "mile" if match[2].startswith("mi") else match[2]
+    return text, round(float(match[1]) * _UNITS[unit])
+
+
+def parse_distances(text):
+    """Distances separated by commas, shortest first"""
+
+    return sorted(
+        (parse_distance(i) for i in text.split(",") if i.strip()),
+        key=lambda distance: distance[1],
+    )
+
+
+def efforts_for(activity_type, distances=None):
+    """distances, or failing that the default (name, metres) for a type
+
+    None for types Strava has best efforts for, so that its own are used
+    rather than fetching every activity's streams."""
+
+    if distances:
+        return distances
+    if activity_type in STRAVA_EFFORTS:
+        return None
+    names = DEFAULT_EFFORTS.get(activity_type, DEFAULT_EFFORTS["Run"])
+    return [parse_distance(name) for name in names]
+
+
+def fastest_segments(time, distance, lengths):
+    """Fastest time over each of lengths within one activity's streams
+
+    For every point the activity could still cover a length from, the end of
+    that length is found by binary search over the cumulative distance, with
+    the time there interpolated between the samples either side; the fastest
+    start is then picked out. Returns the elapsed times, NaN where the
+    activity is too short, and the index each segment starts at."""
+
+    time = np.asarray(time, dtype=float)
+    # GPS corrections can set the distance back slightly
+    distance = np.maximum.accumulate(np.asarray(distance, dtype=float))
+
+    elapsed = np.full(len(lengths), np.nan)
+    starts = np.full(len(lengths), -1)
+    for k, length in enumerate(lengths):
+        if not len(distance) or distance[-1] - distance[0] < length:
+            continue
+
+        n = np.searchsorted(distance, distance[-1] - length, side="right")
+        ends = distance[:n] + length
+        after = np.minimum(
+            np.searchsorted(distance, ends, side="left"), len(distance) - 1
+        )
+        before = after - 1
+        covered = distance[after] - distance[before]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(covered > 0, (ends - distance[before]) / covered, 1.0)
+        times = time[before] + fraction * (time[after] - time[before]) - time[:n]
+
+        best = np.argmin(times)
+        elapsed[k] = times[best]
+        starts[k] = best
+    return elapsed, starts
+
+
+def _encode(time, distance):
+    """Times in seconds and distances in decimetres, each as differences"""
+
+    columns = [
+        np.asarray(time, dtype=np.int64),
+        np.rint(np.asarray(distance, dtype=float) * 10).astype(np.int64),
+    ]
+    return zlib.compress(
+        b"".join(
+            np.diff(column, prepend=0).astype("<i4").tobytes() for column in columns
+        )
+    )
+
+
+def _decode(data, size):
+    columns = np.frombuffer(zlib.decompress(data), dtype="<i4").reshape(2, size)
+    time, distance = np.cumsum(columns, axis=1, dtype=np.int64)
+    return time.astype(float), distance / 10
+
+
+class StreamCache:
+    """Time and distance streams of activities, and the best efforts in them
+
+    Streams are fetched from /activities/{id}/streams once each and stored
+    compactly, as zlib-compressed differences, alongside the distance and
+    elapsed time of the activity they were fetched for, so that they're
+    fetched again if it's edited. The fastest time over each distance is
+    kept per activity and only computed for distances not asked for before.
+    Without a client, only streams already fetched are used."""
+
+    def __init__(self, path, client=None):
+        self._client = client
+
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS activity_streams (
+                    id INTEGER PRIMARY KEY,
+                    distance REAL NOT NULL,
+                    elapsed_time INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    data BLOB NOT NULL
+                )""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS stream_efforts (
+                    id INTEGER NOT NULL,
+                    distance INTEGER NOT NULL,
+                    elapsed_time REAL,
+                    PRIMARY KEY (id, distance)
+                )""")
+
+    def _select(self, query, activity_ids):
+        rows = []
+        # within SQLite's limit on the number of parameters
+        for start in range(0, len(activity_ids), 500):
+            chunk = activity_ids[start : start + 500]
+            rows += self._db.execute(
+                query.format(", ".join("?" * len(chunk))), chunk
+            ).fetchall()
+        return rows
+
+    def _fetch(self, activities):
+        """Fetch and store the streams of activities; returns those stored"""
+
+        if not activities:
+            return set()
+        stats.miss("streams", len(activities))
+        if self._client is None:
+            return set()
+
+        rows = []
+        for activity, data in zip(
+            activities, self._client.get_streams(a.id for a in activities)
+        ):
+            if "time" in data and "distance" in data:
+                time, distance = data["time"]["data"], data["distance"]["data"]
+            elif "errors" not in data or data.get("message") == "Record Not Found":
+                # e.g. entered by hand, so without any streams
+                time, distance = [], []
+            else:
+                continue
+            rows.append(
+                (
+                    activity.id,
+                    activity.distance,
+                    activity.elapsed_time,
+                    len(time),
+                    _encode(time, distance),
+                )
+            )
+
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO activity_streams VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.executemany(
+                "DELETE FROM stream_efforts WHERE id = ?", [row[:1] for row in rows]
+            )
+        return {row[0] for row in rows}
+
+    def best_efforts(self, activities, distances):
+        """Each activity's best efforts over distances, and whether final
+
+        distances are (name, metres), and the efforts (name, elapsed_time)
+        for those the activity covers. Streams not yet fetched are fetched
+        first. An activity whose streams couldn't be had falls back to
+        Strava's own best efforts of the same names, as not final. If
+        distances is None, Strava's own are used for every activity, without
+        any streams."""
+
+        activities = list(activities)
+        if distances is None:
+            return [(list(activity.best_efforts), True) for activity in activities]
+        activity_ids = [activity.id for activity in activities]
+        fetched = {
+            activity_id: (distance, elapsed_time)
+            for activity_id, distance, elapsed_time in self._select(
+                "SELECT id, distance, elapsed_time FROM activity_streams"
+                " WHERE id IN ({})",
+                activity_ids,
+            )
+        }
+        stale = [
+            activity
+            for activity in activities
+            if fetched.get(activity.id) != (activity.distance, activity.elapsed_time)
+        ]
+        stats.hit("streams", len(activities) - len(stale))
+        available = (fetched.keys() - {a.id for a in stale}) | self._fetch(stale)
+
+        known = {
+            (activity_id, metres): elapsed_time
+            for activity_id, metres, elapsed_time in self._select(
+                "SELECT id, distance, elapsed_time FROM stream_efforts"
+                " WHERE id IN ({})",
+                activity_ids,
+            )
+        }
+        self._compute(
+            [
+                activity_id
+                for activity_id in activity_ids
+                if activity_id in available
+                and any((activity_id, m) not in known for _, m in distances)
+            ],
+            distances,
+            known,
+        )
+
+        results = []
+        for activity in activities:
+            if activity.id in available:
+                efforts = [
+                    (name, round(known[activity.id, metres]))
+                    for name, metres in distances
+                    if known[activity.id, metres] is not None
+                ]
+            else:
+                names = {name for name, _ in distances}
+                efforts = [
+                    (name, elapsed_time)
+                    for name, elapsed_time in activity.best_efforts
+                    if name in names
+                ]
+            results.append((efforts, activity.id in available))
+        return results
+
+    def iter_best_efforts(self, activities, distances, batch_size=100):
+        """(activity, efforts) for each of activities, a batch at a time
+
+        As best_efforts(), but for an iterable of activities of any length,
+        without loading them all first."""
+
+        activities = iter(activities)
+        while batch := list(islice(activities, batch_size)):
+            for activity, (efforts, _) in zip(
+                batch, self.best_efforts(batch, distances)
+            ):
+                yield activity, efforts
+
+    def _compute(self, activity_ids, distances, known):
+        if not activity_ids:
+            return
+
+        lengths = [metres for _, metres in distances]
+        rows = []
+        for activity_id, size, data in self._select(
+            "SELECT id, size, data FROM activity_streams WHERE id IN ({})",
+            activity_ids,
+        ):
+            elapsed, _ = fastest_segments(*_decode(data, size), lengths)
+            for metres, elapsed_time in zip(lengths, elapsed.tolist()):
+                if np.isnan(elapsed_time):
+                    elapsed_time = None
+                known[activity_id, metres] = elapsed_time
+                rows.append((activity_id, metres, elapsed_time))
+
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO stream_efforts VALUES (?, ?, ?)", rows
+            )
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,294 @@
+import sqlite3
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+
+from analytics import SplitAnalytics
+from leaderboard import Leaderboard
+
+PERIODS = ("week", "month", "year")
+
+# columns of summary_activities holding each record's figure, and whether
+# the highest or the lowest figure holds it
+RECORDS = {
+    "overall": ("overall_speed", "DESC"),
+    "km": ("km_speed", "DESC"),
+    "consistency": ("variance", "ASC"),
+}
+
+
+def _periods(start_date):
+    """The week (by its Monday), month and year an activity counts towards"""
+
+    day = start_date.date()
+    return (
+        (day - timedelta(days=day.weekday())).isoformat(),
+        day.strftime("%Y-%m"),
+        day.strftime("%Y"),
+    )
+
+
+def _real(value):
+    return None if np.isnan(value) else float(value)
+
+
+class SummaryIndex:
+    """Totals, records and rendered report lines for one activity type
+
+    Persisted next to the activities, and brought up to date by update(),
+    which only looks at activities written or deleted since it last ran.
+    Each activity's contribution is kept, so that one that has changed can
+    be taken back out of the weekly, monthly and yearly totals. Record
+    holders are looked up through indexes over each activity's figures,
+    rather than found by going through the whole history.
+
+    Report lines come from render(activities, analytics), called with each
+    batch of new activities and their SplitAnalytics, which returns a line
+    for each and whether it is final. Lines that aren't, e.g. lacking a
+    place name that couldn't be looked up offline, are rendered again on the
+    next update. Best efforts, kept in leaderboard, are Strava's, unless
+    efforts(activities) is given, which returns each one's (name,
+    elapsed_time) efforts and whether they're final in the same way. A
+    different version, which may be any value with a stable str(), e.g.
+    naming the settings the lines and efforts depend on, rebuilds the whole
+    index."""
+
+    def __init__(self, path, activity_cache, render, efforts=None, version=1):
+        self.activity_type = activity_cache.activity_type
+        self._activity_cache = activity_cache
+        self._render = render
+        self._efforts = efforts
+        self._version = str(version)
+
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS summary_state (
+                    type TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    version TEXT NOT NULL
+                )""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS summary_activities (
+                    id INTEGER PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    start_date REAL NOT NULL,
+                    week TEXT NOT NULL,
+                    month TEXT NOT NULL,
+                    year TEXT NOT NULL,
+                    distance REAL NOT NULL,
+                    moving_time REAL NOT NULL,
+                    elapsed_time REAL NOT NULL,
+                    overall_speed REAL,
+                    km_speed REAL,
+                    variance REAL,
+                    text TEXT NOT NULL,
+                    final INTEGER NOT NULL
+                )""")
+            self._db.execute("""CREATE INDEX IF NOT EXISTS summary_activities_date
+                    ON summary_activities (type, start_date)""")
+            for column, order in RECORDS.values():
+                self._db.execute(f"""CREATE INDEX IF NOT EXISTS
+                        summary_activities_{column}
+                        ON summary_activities (type, {column} {order}, start_date)""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS summary_periods (
+                    type TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    start TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    distance REAL NOT NULL,
+                    moving_time REAL NOT NULL,
+                    elapsed_time REAL NOT NULL,
+                    PRIMARY KEY (type, period, start)
+                )""")
+            # best efforts are kept in leaderboard now
+            self._db.execute("DROP TABLE IF EXISTS summary_efforts")
+
+        row = self._db.execute(
+            "SELECT seq, version FROM summary_state WHERE type = ?",
+            (self.activity_type,),
+        ).fetchone()
+        self._seq = row[0] if row and str(row[1]) == self._version else None
+
+        self.leaderboard = Leaderboard(path, f"summary.{self.activity_type}")
+
+    def update(self, batch_size=500):
+        """Catch up with changes to the activities; returns how many there were"""
+
+        seq, changed = self._activity_cache.changes(self._seq)
+        if self._seq is None:
+            with self._db:
+                for table in ["summary_activities", "summary_periods"]:
+                    self._db.execute(
+                        f"DELETE FROM {table} WHERE type = ?", (self.activity_type,)
+                    )
+            self.leaderboard.clear()
+
+        unfinished = [
+            row[0]
+            for row in self._db.execute(
+                "SELECT id FROM summary_activities WHERE type = ? AND NOT final",
+                (self.activity_type,),
+            )
+        ]
+        activity_ids = list(dict.fromkeys([*changed, *unfinished]))
+
+        # one transaction per batch, and none while rendering, which may
+        # write to the same database (e.g. the location cache); until the
+        # state is written, a batch done twice comes out the same
+        for start in range(0, len(activity_ids), batch_size):
+            batch = activity_ids[start : start + batch_size]
+            rows, efforts = self._rows(self._activity_cache.get_many(batch))
+            with self._db:
+                self._remove(batch)
+                self._add(rows)
+            self.leaderboard.remove(batch)
+            self.leaderboard.update(efforts)
+
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO summary_state VALUES (?, ?, ?)",
+                (self.activity_type, seq, self._version),
+            )
+        self._seq = seq
+        return len(activity_ids)
+
+    def _remove(self, activity_ids):
+        placeholders = ", ".join("?" * len(activity_ids))
+        rows = self._db.execute(
+            f"""SELECT week, month, year, distance, moving_time, elapsed_time
+                FROM summary_activities WHERE type = ? AND id IN ({placeholders})""",
+            (self.activity_type, *activity_ids),
+        ).fetchall()
+        if not rows:
+            return
+
+        self._add_to_periods(
+            (starts, -1, -distance, -moving_time, -elapsed_time)
+            for *starts, distance, moving_time, elapsed_time in rows
+        )
+        self._db.execute(
+            "DELETE FROM summary_periods WHERE type = ? AND count <= 0",
+            (self.activity_type,),
+        )
+        self._db.execute(
+            f"""DELETE FROM summary_activities
+                WHERE type = ? AND id IN ({placeholders})""",
+            (self.activity_type, *activity_ids),
+        )
+
+    def _rows(self, activities):
+        if not activities:
+            return [], []
+
+        analytics = SplitAnalytics(activities, self.activity_type)
+        overall_speed = np.where(
+            analytics.distance > 900, analytics.average_speed, np.nan
+        )
+        km_speed = np.full(len(activities), np.nan)
+        np.fmax.at(
+            km_speed,
+            analytics.split_activity[analytics.counted],
+            analytics.km_speed[analytics.counted],
+        )
+
+        if self._efforts is None:
+            best_efforts = [(list(a.best_efforts), True) for a in activities]
+        else:
+            best_efforts = self._efforts(activities)
+
+        rows = []
+        efforts = []
+        rendered = list(self._render(activities, analytics))
+        for i, activity in enumerate(activities):
+            text, final = rendered[i]
+            activity_efforts, efforts_final = best_efforts[i]
+            rows.append(
+                (
+                    activity.id,
+                    self.activity_type,
+                    activity.start_date.timestamp(),
+                    *_periods(activity.start_date),
+                    activity.distance,
+                    activity.moving_time,
+                    activity.elapsed_time,
+                    _real(overall_speed[i]),
+                    _real(km_speed[i]),
+                    _real(analytics.variance[i]),
+                    text,
+                    final and efforts_final,
+                )
+            )
+            efforts.append((activity, activity_efforts))
+        return rows, efforts
+
+    def _add(self, rows):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO summary_activities"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        self._add_to_periods((row[3:6], 1, *row[6:9]) for row in rows)
+
+    def _add_to_periods(self, contributions):
+        totals = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+        for starts, *figures in contributions:
+            for period, start in zip(PERIODS, starts):
+                total = totals[period, start]
+                for j, figure in enumerate(figures):
+                    total[j] += figure
+
+        self._db.executemany(
+            """INSERT INTO summary_periods VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (type, period, start) DO UPDATE SET
+                    count = count + excluded.count,
+                    distance = distance + excluded.distance,
+                    moving_time = moving_time + excluded.moving_time,
+                    elapsed_time = elapsed_time + excluded.elapsed_time""",
+            [
+                (self.activity_type, period, start, *total)
+                for (period, start), total in totals.items()
+            ],
+        )
+
+    def lines(self):
+        """The report's lines for every activity, in date order"""
+
+        for (text,) in self._db.execute(
+            "SELECT text FROM summary_activities WHERE type = ?"
+            " ORDER BY start_date, id",
+            (self.activity_type,),
+        ):
+            yield text
+
+    def best(self, record):
+        """(activity id, figure) of a record's holder, or None if there is none
+
+        record is "overall" for the fastest activity over 900m, by average
+        speed; "km" for the fastest split, by its speed; or "consistency"
+        for the most even splits, by their variance. Ties go to the earlier
+        activity."""
+
+        column, order = RECORDS[record]
+        return self._db.execute(
+            f"""SELECT id, {column} FROM summary_activities
+                WHERE type = ? AND {column} IS NOT NULL
+                ORDER BY {column} {order}, start_date, id LIMIT 1""",
+            (self.activity_type,),
+        ).fetchone()
+
+    def periods(self, period, n=None):
+        """Totals for each week, month or year, most recent first
+
+        As (start, count, distance, moving_time, elapsed_time), where start
+        is the date of the week's Monday, "YYYY-MM" or "YYYY"."""
+
+        return self._db.execute(
+            """SELECT start, count, distance, moving_time, elapsed_time
+                FROM summary_periods WHERE type = ? AND period = ?
+                ORDER BY start DESC LIMIT ?""",
+            (self.activity_type, period, -1 if n is None else n),
+        ).fetchall()
+
+    def close(self):
+        self._db.close()
+        self.leaderboard.close()
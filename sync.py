@@ -0,0 +1,244 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+from instrumentation import stats
+from store import ActivityStore
+from streams import parse_distances
+from strava import Strava
+
+IGNORED_ACTIVITIES = [49385397, 49451690, 294364499]
+
+# fields present in both the summary listing and the detailed activity, used to
+# spot activities that have been edited since they were cached
+_COMPARED_FIELDS = ["name", "type", "distance", "moving_time", "elapsed_time"]
+
+
+class Watermark:
+    """Newest activity seen by a previous sync
+
+    Persisted next to the activity cache so that routine runs only need to
+    list activities started after it."""
+
+    def __init__(self, path):
+        self._path = path
+        self.since = None
+        self.start_date = None
+        self.id = None
+
+        if self._path.exists():
+            data = json.loads(self._path.read_text())
+            self.since = datetime.fromisoformat(data["since"])
+            self.start_date = datetime.fromisoformat(data["start_date"])
+            self.id = data["id"]
+
+    def covers(self, since):
+        return self.start_date is not None and self.since <= since
+
+    def update(self, activity):
+        if self.start_date is None or activity["start_date"] > self.start_date:
+            self.start_date = activity["start_date"]
+            self.id = activity["id"]
+
+    def save(self):
+        if self.start_date is None:
+            return
+        self._path.write_text(
+            json.dumps(
+                {
+                    "since": self.since.isoformat(),
+                    "start_date": self.start_date.isoformat(),
+                    "id": self.id,
+                }
+            )
+        )
+
+
+def _fingerprint(summary):
+    return [summary.get(field) for field in _COMPARED_FIELDS]
+
+
+def sync(client, activity_caches, watermarks, since, full_resync=False):
+    """Bring the activity caches, one per type, up to date with Strava
+
+    activity_caches and watermarks map each activity type to sync to its
+    cache and watermark. The history is listed once for all of them, and
+    details of every type are fetched together.
+
+    For each type, only activities newer than its watermark are needed,
+    unless full_resync is set or the watermark was built from a later
+    starting point, in which case its whole history since `since` is
+    checked: edited activities are fetched again and deleted ones are
+    dropped from the cache. The listing starts from the earliest point any
+    type needs.
+
+    Listing and fetching details run ahead in the background, and each
+    activity is stored as soon as it arrives."""
+
+    full = {
+        activity_type: full_resync or not watermark.covers(since)
+        for activity_type, watermark in watermarks.items()
+    }
+    after = min(
+        since if full[activity_type] else watermark.start_date
+        for activity_type, watermark in watermarks.items()
+    )
+
+    # read up front, as the details to fetch are decided in the background
+    cached = {}
+    for activity_type, activity_cache in activity_caches.items():
+        if full[activity_type]:
+            cached[activity_type] = {
+                activity_id: (
+                    [getattr(activity, field) for field in _COMPARED_FIELDS],
+                    activity.start_date,
+                )
+                for activity_id, activity in activity_cache.items()
+            }
+        else:
+            cached[activity_type] = dict.fromkeys(activity_cache)
+
+    def stale(summary):
+        activity_type = summary["type"]
+        if activity_type not in cached or summary["id"] in IGNORED_ACTIVITIES:
+            return False
+        if summary["id"] in cached[activity_type] and not (
+            full[activity_type]
+            and _fingerprint(summary) != cached[activity_type][summary["id"]][0]
+        ):
+            stats.hit("activities")
+            return False
+        stats.miss("activities")
+        return True
+
+    seen = set()
+    for summary, activity in client.iter_activities(
+        # the watermark activity itself is listed again, and skipped as it's
+        # cached, so that others starting in the same second aren't lost
+        params={"after": int(after.timestamp()) - 1},
+        details=stale,
+    ):
+        seen.add((summary["type"], summary["id"]))
+        for watermark in watermarks.values():
+            watermark.update(summary)
+        if activity:
+            activity_caches[summary["type"]][activity["id"]] = activity
+
+    for activity_type, activity_cache in activity_caches.items():
+        if not full[activity_type]:
+            continue
+        for activity_id, (_, start_date) in cached[activity_type].items():
+            if (activity_type, activity_id) not in seen and start_date >= since:
+                del activity_cache[activity_id]
+        watermarks[activity_type].since = since
+
+    return activity_caches
+
+
+def add_arguments(parser, action):
+    """The arguments report.py and dayone.py share, for SyncedCaches
+
+    action says what the scripts do with the activity types given, e.g.
+    "report on"."""
+
+    parser.add_argument(
+        "activity_types",
+        nargs="*",
+        default=["Run"],
+        type=str.capitalize,
+        metavar="activity_type",
+        help=f"activity types to {action}, synced together (default: Run)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        metavar="DIR",
+        help="where the caches and the Strava token are kept"
+        " (default: $XDG_CACHE_HOME)",
+    )
+    parser.add_argument(
+        "--full-resync",
+        action="store_true",
+        help="re-list the whole history to pick up edited and deleted activities",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="use the local caches only, without contacting Strava, MapBox or"
+        " the maps API",
+    )
+    parser.add_argument(
+        "--efforts",
+        type=parse_distances,
+        metavar="DISTANCES",
+        help="distances to rank best efforts over, e.g. 1k,3k,15k,1 mile"
+        " (default: Strava's for runs, 5k to 100k for rides)",
+    )
+    parser.add_argument(
+        "--stats",
+        metavar="FILE",
+        help="write timings, request counts and cache hit rates as JSON to FILE"
+        " when done, or to stderr if FILE is -",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write a cProfile profile of the work after syncing to FILE",
+    )
+
+
+class SyncedCaches:
+    """The activity caches for the types asked for, synced with Strava
+
+    Opens an ActivityStore and a Watermark for each of args.activity_types
+    in args.cache_dir, creates the client and syncs everything started since
+    `since`, unless args.offline is set, in which case client is None. Only
+    now, as creating the client may refresh the token or even start the
+    OAuth flow in a browser. close() saves the watermarks."""
+
+    def __init__(self, args, since, rate_limiter=None):
+        if args.stats:
+            stats.enable(args.stats)
+
+        self.offline = args.offline
+        self.cache_dir = args.cache_dir or Path(os.environ["XDG_CACHE_HOME"])
+        # in the order given, without repeats
+        self.activity_types = list(dict.fromkeys(args.activity_types))
+        self.activity_caches = {
+            activity_type: ActivityStore(
+                self.cache_dir / "strava.sqlite", activity_type
+            )
+            for activity_type in self.activity_types
+        }
+        self.watermarks = {
+            activity_type: Watermark(
+                self.cache_dir / f"strava.{activity_type.lower()}.watermark"
+            )
+            for activity_type in self.activity_types
+        }
+
+        self.client = None
+        if not args.offline:
+            with stats.phase("auth"):
+                self.client = Strava(
+                    os.environ["STRAVA_CLIENT_ID"],
+                    os.environ["STRAVA_CLIENT_SECRET"],
+                    token_file=self.cache_dir / "strava_token",
+                    rate_limiter=rate_limiter,
+                )
+            with stats.phase("sync"):
+                sync(
+                    self.client,
+                    self.activity_caches,
+                    self.watermarks,
+                    since,
+                    full_resync=args.full_resync,
+                )
+
+    def close(self):
+        for activity_cache in self.activity_caches.values():
+            activity_cache.close()
+        if not self.offline:
+            for watermark in self.watermarks.values():
+                watermark.save()